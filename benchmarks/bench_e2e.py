@@ -0,0 +1,294 @@
+"""
+Offline end-to-end benchmark: runs the pipeline against local fakes of Google Trends, NewsAPI, the publishers'
+article pages, Tor (SOCKS + control port) and SMTP (see benchmarks/fakes.py), and reports per stage
+
+  wall time, requests issued and bytes transferred (counted by the fakes), and peak RSS of this process
+  plus its children (the NLP process pool).
+
+Nothing leaves the machine. The run happens in a scratch directory with copies of phrases.txt and
+country_codes.json, so caches start cold unless --workdir points at a previous run. Tuning knobs can be set
+with --env (e.g. --env TRENDS_MIN_DELAY=0.5) and every fake takes latency and error-rate overrides.
+
+With --mode shards the run is split into --shards N shards (run one after another, each as
+`run --shard I/N` would) followed by the reduce step; the total then also shows the critical path,
+i.e. the slowest shard plus the reduce, which is the wall time when the shards run in parallel.
+
+Usage:
+  python benchmarks/bench_e2e.py [--mode stages|main|shards] [--shards N] [--to-stage STAGE]
+                                 [--latency trends=0.5 ...] [--errors newsapi=0.1 ...] [--jitter 0.5]
+                                 [--corpus DIR] [--env KEY=VALUE ...] [--workdir DIR] [--verbose]
+                                 [--json results.json] [--compare baseline.json]
+
+Needs the openssl CLI (for the fake Trends/SMTP TLS certificate) and the packages in requirements.txt.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import fakes
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ORIGIN_SERVICES = ["trends", "newsapi", "html", "smtp"]  # tor only relays (and answers the IP checks)
+
+#---------------------------------------------------------------------------------------------------------------------------
+class RssSampler(threading.Thread):
+    """Samples the RSS of this process and its descendants (minus `exclude`) and keeps the peak since reset()."""
+
+    def __init__(self, exclude=(), interval=0.02):
+        super().__init__(daemon=True)
+        self.exclude = set(exclude)
+        self.interval = interval
+        self.peak = 0
+        self._halt = threading.Event()
+        self._proc = os.path.exists("/proc/self/status")
+
+    @staticmethod
+    def _rss(pid):
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    def _tree(self, pid):
+        pids = [pid]
+        try:
+            for tid in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{tid}/children") as f:
+                    for child in f.read().split():
+                        if int(child) not in self.exclude:
+                            pids.extend(self._tree(int(child)))
+        except OSError:
+            pass
+        return pids
+
+    def current(self):
+        if not self._proc:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # lifetime peak only
+        return sum(self._rss(pid) for pid in self._tree(os.getpid()))
+
+    def reset(self):
+        self.peak = self.current()
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+    def stop(self):
+        self._halt.set()
+
+def _diff(after, before):
+    return {service: {key: after[service][key] - before[service].get(key, 0) for key in after[service]}
+            for service in after}
+
+def _measure(name, fn, services, sampler, log):
+    before = services.stats()
+    sampler.reset()
+    started = time.perf_counter()
+    error = None
+    try:
+        with contextlib.redirect_stdout(log):
+            fn()
+    except Exception as e:  # a failed stage is still reported, and stops the run
+        error = f"{type(e).__name__}: {e}"
+    wall = time.perf_counter() - started
+    per_service = _diff(services.stats(), before)
+    result = {
+        "wall_s": round(wall, 3),
+        "requests": sum(per_service[s]["requests"] for s in ORIGIN_SERVICES),
+        "bytes": sum(per_service[s]["bytes_in"] + per_service[s]["bytes_out"] for s in ORIGIN_SERVICES),
+        "peak_rss_mb": round(max(sampler.peak, sampler.current()) / 2 ** 20, 1),
+        "services": per_service,
+    }
+    if error:
+        result["error"] = error
+    return result
+
+#---------------------------------------------------------------------------------------------------------------------------
+def _pairs(values, cast=str):
+    result = {}
+    for value in values or []:
+        key, _, raw = value.partition("=")
+        result[key.strip()] = cast(raw)
+    return result
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _prepare_workdir(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="news-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    for src in (args.phrases, args.codes):
+        dst = os.path.join(workdir, os.path.basename(src))
+        if not os.path.exists(dst):
+            shutil.copy(src, dst)
+    return workdir
+
+def _point_at_fakes(ns, ports):
+    """Aim the module and pytrends at the fakes (endpoints that have no env knob)."""
+    import pytrends.request as pytrends_request
+    newsapi = f"http://127.0.0.1:{ports['newsapi']}"
+    ns.BASE_URL = f"{newsapi}/v2/everything"
+    ns.SOURCES_URL = f"{newsapi}/v2/sources"
+    # https, so pytrends sends it through the circuit's SOCKS proxy like the real thing
+    base = f"https://localhost:{ports['trends']}{fakes.TRENDS_PREFIX}"
+    pytrends_request.BASE_TRENDS_URL = base
+    trend_req = pytrends_request.TrendReq
+    trend_req.GENERAL_URL = f"{base}/api/explore"
+    trend_req.INTEREST_OVER_TIME_URL = f"{base}/api/widgetdata/multiline"
+
+def run(args):
+    workdir = _prepare_workdir(args)
+    cert, key = fakes.make_certificate(workdir)
+    with open(args.codes, encoding="utf-8") as f:
+        country_codes = sorted(set(json.load(f).values()))
+    config = {"latency": _pairs(args.latency, float), "errors": _pairs(args.errors, float), "jitter": args.jitter,
+              "corpus_dir": args.corpus, "corpus_size": args.corpus_size, "country_codes": country_codes,
+              "cert": cert, "key": key}
+    services = fakes.start(config)
+    ports = services.ports
+
+    os.environ.update({
+        "NEWS_API_KEY": "bench-key",
+        "EMAIL_HOST": "localhost", "EMAIL_PORT": str(ports["smtp"]),
+        "EMAIL_USER": "bench@localhost", "EMAIL_PASSWORD": "bench", "EMAIL_TO": "digest@localhost",
+        "TOR_SOCKS_HOST": "127.0.0.1", "TOR_SOCKS_PORTS": str(ports["tor"]),
+        "TOR_CONTROL_PORT": str(ports["tor_control"]),
+        "REQUESTS_CA_BUNDLE": cert,
+    })
+    knobs = _pairs(args.env)
+    os.environ.update(knobs)
+
+    sampler = RssSampler(exclude=[services.pid])
+    sampler.start()
+    log = sys.stdout if args.verbose else open(os.path.join(workdir, "pipeline.log"), "w", encoding="utf-8")
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    results = {}
+    try:
+        sys.path.insert(0, REPO_ROOT)
+        results["import"] = _measure("import", lambda: __import__("news_scraper"), services, sampler, log)
+        ns = sys.modules["news_scraper"]
+        _point_at_fakes(ns, ports)
+
+        if args.mode == "main":
+            results["pipeline"] = _measure("pipeline", lambda: ns.main(["run"]), services, sampler, log)
+        elif args.mode == "shards":
+            run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+            for index in range(1, args.shards + 1):
+                shard = ns.Shard(index, args.shards)
+                print(f"[INFO] Shard {index}/{args.shards}...", file=sys.stderr)
+                results[f"shard {index}"] = _measure(f"shard {index}", lambda: ns.run_shard(shard, run_id=run_id),
+                                                     services, sampler, log)
+            print("[INFO] Reduce...", file=sys.stderr)
+            results["reduce"] = _measure("reduce", lambda: ns.reduce_shards(run_id=run_id), services, sampler, log)
+        else:
+            run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+            last = ns.STAGES.index(args.to_stage) if args.to_stage else len(ns.STAGES) - 1
+            for stage in ns.STAGES[:last + 1]:
+                print(f"[INFO] Stage '{stage}'...", file=sys.stderr)
+                results[stage] = _measure(stage, lambda: ns.run_pipeline(run_id=run_id, from_stage=stage,
+                                                                         to_stage=stage),
+                                          services, sampler, log)
+                if "error" in results[stage]:
+                    break
+    finally:
+        os.chdir(previous_cwd)
+        sampler.stop()
+        services.close()
+        if log is not sys.stdout:
+            log.close()
+
+    stages = [r for name, r in results.items() if name != "import"]
+    report = {
+        "meta": {"commit": _git_commit(), "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                 "python": platform.python_version(), "platform": platform.platform(), "mode": args.mode,
+                 "fakes": {"latency": dict(fakes.DEFAULT_LATENCY, **config["latency"]), "errors": config["errors"],
+                           "jitter": args.jitter, "corpus": args.corpus or f"generated:{args.corpus_size}"},
+                 "env": knobs, "workdir": workdir},
+        "stages": results,
+        "total": {"wall_s": round(sum(r["wall_s"] for r in stages), 3),
+                  "requests": sum(r["requests"] for r in stages),
+                  "bytes": sum(r["bytes"] for r in stages),
+                  "peak_rss_mb": max((r["peak_rss_mb"] for r in stages), default=0)},
+    }
+    if args.mode == "shards" and "reduce" in results:
+        shard_walls = [r["wall_s"] for name, r in results.items() if name.startswith("shard ")]
+        report["total"]["critical_path_s"] = round(max(shard_walls, default=0) + results["reduce"]["wall_s"], 3)
+    if not args.workdir and not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+#---------------------------------------------------------------------------------------------------------------------------
+def _delta(new, old):
+    if not old:
+        return ""
+    return f" ({(new - old) / old:+.0%})"
+
+def print_report(report, baseline=None):
+    base_stages = (baseline or {}).get("stages", {})
+    print(f"{'stage':<10} {'wall s':>14} {'requests':>14} {'bytes':>18} {'peak RSS MB':>16}")
+    for name, r in list(report["stages"].items()) + [("total", report["total"])]:
+        old = base_stages.get(name) or ((baseline or {}).get("total") if name == "total" else None) or {}
+        print(f"{name:<10} {r['wall_s']:>8.2f}{_delta(r['wall_s'], old.get('wall_s')):>6} "
+              f"{r['requests']:>8}{_delta(r['requests'], old.get('requests')):>6} "
+              f"{r['bytes']:>12}{_delta(r['bytes'], old.get('bytes')):>6} "
+              f"{r['peak_rss_mb']:>10.1f}{_delta(r['peak_rss_mb'], old.get('peak_rss_mb')):>6}"
+              + (f"  [ERROR] {r['error']}" if r.get("error") else ""))
+    if "critical_path_s" in report["total"]:
+        print(f"critical path (shards in parallel + reduce): {report['total']['critical_path_s']:.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["stages", "main", "shards"], default="stages",
+                        help="time every stage separately, main() as one span, or a sharded run and its reduce")
+    parser.add_argument("--shards", type=int, default=2, help="number of shards (shards mode)")
+    parser.add_argument("--to-stage", help="stop after this stage (stages mode)")
+    parser.add_argument("--latency", action="append", metavar="SERVICE=SECONDS",
+                        help=f"mean added latency per request; services: {', '.join(fakes.SERVICES)}")
+    parser.add_argument("--errors", action="append", metavar="SERVICE=FRACTION", help="share of requests that fail")
+    parser.add_argument("--jitter", type=float, default=0.5, help="latency varies by ± this fraction")
+    parser.add_argument("--corpus", help="serve the *.html files of this directory instead of generated articles")
+    parser.add_argument("--corpus-size", type=int, default=400)
+    parser.add_argument("--phrases", default=os.path.join(REPO_ROOT, "phrases.txt"))
+    parser.add_argument("--codes", default=os.path.join(REPO_ROOT, "country_codes.json"))
+    parser.add_argument("--env", action="append", metavar="KEY=VALUE", help="news_scraper tuning knobs")
+    parser.add_argument("--workdir", help="run here (and keep it) instead of a fresh scratch directory")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results of an earlier run to show deltas against")
+    args = parser.parse_args()
+
+    report = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Compared with {baseline['meta'].get('commit') or args.compare}")
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    failed = [name for name, r in report["stages"].items() if r.get("error")]
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Startup benchmark for `import news_scraper`.
+
+Runs the import in a fresh interpreter under `python -X importtime`, with no credentials in the
+environment, and fails if
+  - the import raises (it must not need NEWS_API_KEY, SMTP settings, phrases.txt or Tor),
+  - any heavy dependency is imported eagerly, or
+  - the cumulative import time of news_scraper exceeds the budget (best of N runs).
+
+Usage: python benchmarks/bench_import.py [--budget-ms 150] [--runs 5] [--json results.json]
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUDGET_MS = 150  # eager imports used to cost well over a second; any heavy import blows this
+HEAVY_MODULES = ["requests", "pandas", "pyarrow", "numpy", "pytrends", "stem", "newspaper", "nltk", "smtplib"]
+
+PROBE = f"""
+import sys
+sys.path.insert(0, {REPO_ROOT!r})
+import news_scraper
+print("LOADED=" + ",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+
+def measure_once():
+    # A scrubbed environment: no credentials, no .env overrides of the tuning knobs
+    env = {key: value for key, value in os.environ.items()
+           if key not in ("NEWS_API_KEY", "EMAIL_HOST", "EMAIL_PORT", "EMAIL_USER", "EMAIL_PASSWORD", "EMAIL_TO")}
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=os.path.dirname(REPO_ROOT),
+                          env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise SystemExit(f"[FAIL] import news_scraper raised:\n{proc.stderr[-2000:]}")
+
+    cumulative_us = None
+    for line in proc.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+news_scraper$", line)
+        if match:
+            cumulative_us = int(match.group(2))
+    loaded = proc.stdout.strip().split("LOADED=", 1)[-1]
+    return cumulative_us / 1000, [m for m in loaded.split(",") if m]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", DEFAULT_BUDGET_MS)))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    timings, eager = [], set()
+    for _ in range(args.runs):
+        ms, loaded = measure_once()
+        timings.append(ms)
+        eager.update(loaded)
+
+    best = min(timings)
+    result = {"best_ms": round(best, 2), "runs_ms": [round(t, 2) for t in timings],
+              "budget_ms": args.budget_ms, "eager_heavy_modules": sorted(eager)}
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    failed = False
+    if eager:
+        print(f"[FAIL] heavy modules imported at module load: {', '.join(sorted(eager))}")
+        failed = True
+    if best > args.budget_ms:
+        print(f"[FAIL] import took {best:.1f} ms, budget is {args.budget_ms:.1f} ms")
+        failed = True
+    if not failed:
+        print(f"[OK] import news_scraper: {best:.1f} ms (budget {args.budget_ms:.1f} ms)")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
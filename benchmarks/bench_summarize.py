@@ -0,0 +1,148 @@
+"""
+Summarizer benchmark: newspaper's per-article nlp() (the SUMMARY_ENGINE=newspaper path) against the batched
+TF-IDF engine (summarize_texts / summarize_extracted), on the same article HTML.
+
+Reports, for each engine,
+  - end to end (HTML → summary) on a process pool of --workers, as summarize_articles runs it,
+  - summarizer only, on texts that were already parsed (serial newspaper nlp() vs one summarize_texts batch),
+  - a warm summary-cache pass for the batched engine,
+and compares the outputs: how often nlp() failed and fell back to the first 500 characters, mean summary
+length, and the unigram overlap (ROUGE-1 F1) and shared sentences between the two summaries.
+
+Articles come from the generated corpus of benchmarks/fakes.py, or the *.html files of --corpus.
+
+Usage: python benchmarks/bench_summarize.py [--corpus DIR] [--corpus-size 200] [--workers N] [--runs 3]
+                                            [--json results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import fakes
+import news_scraper as ns
+
+#---------------------------------------------------------------------------------------------------------------------------
+def _best(fn, runs):
+    """Best wall time of `runs` calls, and the result of the last one."""
+    times, result = [], None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return min(times), result
+
+def _legacy_nlp(article):
+    # What _summarize_html does after parse(), on an article parsed beforehand
+    try:
+        article.nlp()
+        return article.summary, False
+    except Exception:
+        return article.text[:500], True
+
+def _rouge1(a, b):
+    a, b = ns._TOKEN.findall((a or "").lower()), ns._TOKEN.findall((b or "").lower())
+    if not a or not b:
+        return 0.0
+    common = sum(min(a.count(t), b.count(t)) for t in set(a))
+    return 2 * common / (len(a) + len(b))
+
+def _sentences(summary):
+    return {line.strip() for line in (summary or "").split("\n") if line.strip()}
+
+#---------------------------------------------------------------------------------------------------------------------------
+def run(args):
+    corpus = fakes.Corpus(args.corpus_size, html_dir=args.corpus)
+    pages = [(f"http://bench.local/article/{corpus.slug(i)}", corpus.html(i)) for i in range(corpus.size)]
+    urls, htmls = [url for url, _ in pages], [html for _, html in pages]
+    newspaper = ns._newspaper()
+    results = {}
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        list(pool.map(ns._extract_article, urls[:args.workers], htmls[:args.workers]))  # warm the workers up
+
+        seconds, legacy = _best(lambda: list(pool.map(ns._summarize_html, urls, htmls, chunksize=4)), args.runs)
+        results["newspaper_e2e"] = seconds
+
+        def batched():
+            extracted = list(pool.map(ns._extract_article, urls, htmls, chunksize=4))
+            return ns.summarize_texts([text for _, text in extracted], [title for title, _ in extracted])
+        seconds, _ = _best(batched, args.runs)
+        results["tfidf_e2e"] = seconds
+
+    parsed = []
+    for url, html in pages:
+        article = newspaper.Article(url)
+        article.download(input_html=html)
+        article.parse()
+        parsed.append(article)
+    seconds, legacy_only = _best(lambda: [_legacy_nlp(a) for a in parsed], args.runs)
+    results["newspaper_only"] = seconds
+    texts, titles = [a.text for a in parsed], [a.title for a in parsed]
+    seconds, tfidf = _best(lambda: ns.summarize_texts(texts, titles), args.runs)
+    results["tfidf_only"] = seconds
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ns.SummaryCache(os.path.join(tmp, "summaries.sqlite"))
+        extracted = list(zip(titles, texts))
+        ns.summarize_extracted(extracted, cache=cache)
+        seconds, _ = _best(lambda: ns.summarize_extracted(extracted, cache=cache), args.runs)
+        results["tfidf_cached"] = seconds
+
+    fallbacks = sum(failed for _, failed in legacy_only)
+    pairs = [(old, new) for (old, failed), new in zip(legacy_only, tfidf) if not failed and old and new]
+    return {
+        "meta": {"articles": len(pages), "workers": args.workers, "runs": args.runs,
+                 "corpus": args.corpus or f"generated:{args.corpus_size}"},
+        "seconds": {name: round(value, 4) for name, value in results.items()},
+        "articles_per_s": {name: round(len(pages) / value, 1) if value else None for name, value in results.items()},
+        "output": {
+            "newspaper_fallbacks": fallbacks,
+            "tfidf_empty": sum(summary is None for summary in tfidf),
+            "mean_chars": {"newspaper": round(statistics.mean(len(s or "") for s in legacy) if legacy else 0),
+                           "tfidf": round(statistics.mean(len(s or "") for s in tfidf) if tfidf else 0)},
+            "compared": len(pairs),
+            "rouge1_f1": round(statistics.mean(_rouge1(a, b) for a, b in pairs), 3) if pairs else None,
+            "shared_sentences": round(statistics.mean(len(_sentences(a) & _sentences(b)) / max(len(_sentences(b)), 1)
+                                                      for a, b in pairs), 3) if pairs else None,
+        },
+    }
+
+def print_report(report):
+    meta, seconds, rate = report["meta"], report["seconds"], report["articles_per_s"]
+    print(f"{meta['articles']} articles ({meta['corpus']}), {meta['workers']} workers, best of {meta['runs']}")
+    print(f"{'path':<16} {'seconds':>10} {'articles/s':>12}")
+    for name in seconds:
+        print(f"{name:<16} {seconds[name]:>10.3f} {rate[name] or 0:>12.1f}")
+    out = report["output"]
+    print(f"newspaper nlp() fallbacks to text[:500]: {out['newspaper_fallbacks']}/{meta['articles']}, "
+          f"tfidf without sentences: {out['tfidf_empty']}")
+    print(f"mean summary length: newspaper {out['mean_chars']['newspaper']} chars, tfidf {out['mean_chars']['tfidf']}")
+    if out["compared"]:
+        print(f"on {out['compared']} articles both summarized: ROUGE-1 F1 {out['rouge1_f1']:.3f}, "
+              f"{out['shared_sentences']:.0%} of tfidf sentences also picked by newspaper")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="summarize the *.html files of this directory")
+    parser.add_argument("--corpus-size", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=ns.NLP_WORKERS)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,697 @@
+"""
+Local stand-ins for every external service news_scraper talks to, for offline benchmarks.
+
+  trends    Google Trends (cookie page, /api/explore, /api/widgetdata/multiline), served over TLS
+  newsapi   NewsAPI /v2/sources and /v2/everything
+  html      a static article-HTML corpus (generated, or the *.html files of --corpus)
+  tor       a SOCKS5 port that isolates circuits by credentials (like Tor) and answers httpbin.org/ip
+            with a per-circuit exit IP, plus a control port that understands AUTHENTICATE and SIGNAL NEWNYM
+  smtp      an SMTP sink with STARTTLS and AUTH that counts and discards messages
+
+Every service can add latency (mean ± jitter seconds) and inject errors (a fraction of requests get a 429,
+503, refused CONNECT or 451, whichever fits the protocol). Request and byte counters are served as JSON on
+an admin port that is not counted itself.
+
+Run as a script it reads a JSON config on stdin, prints {"ports": {...}} once everything listens, and serves
+until stdin is closed. `start()` does that in a child process, so the fakes never share the measured
+process's GIL or memory.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import select
+import socket
+import socketserver
+import ssl
+import struct
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+SERVICES = ["trends", "newsapi", "html", "tor", "smtp"]
+DEFAULT_LATENCY = {"trends": 0.25, "newsapi": 0.05, "html": 0.05, "tor": 0.02, "smtp": 0.01}
+TRENDS_PREFIX = "/trends"
+LAST_MODIFIED = "Mon, 05 Oct 2026 08:00:00 GMT"  # every page and the sources list, for conditional GETs
+
+#---------------------------------------------------------------------------------------------------------------------------
+class Counters:
+    """Per-service request/byte counters, shared by every handler thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {name: {"requests": 0, "errors_injected": 0, "bytes_in": 0, "bytes_out": 0} for name in SERVICES}
+        self._data["tor"].update(connections=0, circuits=0, newnym=0)
+        self._usernames = set()
+
+    def add(self, service, key, amount=1):
+        with self._lock:
+            self._data[service][key] += amount
+
+    def circuit(self, username):
+        with self._lock:
+            if username not in self._usernames:
+                self._usernames.add(username)
+                self._data["tor"]["circuits"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps(self._data))
+
+class Fault:
+    """Latency and error injection for one service."""
+
+    def __init__(self, latency=0.0, jitter=0.5, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            seconds = self.latency * self._rng.uniform(1 - self.jitter, 1 + self.jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def fail(self):
+        with self._lock:
+            return self._rng.random() < self.error_rate
+
+class _Counted:
+    """File wrapper that adds every byte read or written to a counter."""
+
+    def __init__(self, f, counters, service, key):
+        self._f, self._counters, self._service, self._key = f, counters, service, key
+
+    def read(self, *args):
+        data = self._f.read(*args)
+        self._counters.add(self._service, self._key, len(data))
+        return data
+
+    def readline(self, *args):
+        data = self._f.readline(*args)
+        self._counters.add(self._service, self._key, len(data))
+        return data
+
+    def write(self, data):
+        self._counters.add(self._service, self._key, len(data))
+        return self._f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+def _stable_hash(*parts):
+    return int.from_bytes(hashlib.sha1("|".join(map(str, parts)).encode("utf-8")).digest()[:8], "big")
+
+#---------------------------------------------------------------------------------------------------------------------------
+# Article corpus shared by the NewsAPI fake (titles, URLs) and the HTML server (bodies)
+WORDS = ("cement clinker limestone gypsum coal freight port vessel tariff demand supply price plant kiln capacity "
+         "quarter market export import shipment tonnes contract producer energy fuel power grid slag furnace "
+         "construction housing infrastructure ministry regulator analyst forecast margin output inventory buyer "
+         "seller spot index premium discount congestion backlog terminal berth charter rate bulk carrier monsoon "
+         "season government policy subsidy levy duty region province industry association").split()
+# Body sentences mix in function words, so they read as prose to newspaper's extractor (it scores stopwords)
+FILLERS = "the of and in to for on with as by at from that is was are were has have will said this after".split()
+
+class Corpus:
+    """Deterministic set of stories. Every `syndicate_every`-th story is a wire copy of the one before it."""
+
+    def __init__(self, size=400, seed=7, syndicate_every=5, html_dir=None):
+        self.size = size
+        self.seed = seed
+        self.syndicate_every = syndicate_every
+        self.files = sorted(f for f in os.listdir(html_dir) if f.endswith(".html")) if html_dir else []
+        self.html_dir = html_dir
+        if self.files:
+            self.size = len(self.files)
+
+    def _sentence(self, rng, words=None, prose=False):
+        words = words or rng.randint(9, 22)
+        text = " ".join(rng.choice(FILLERS) if prose and i % 3 == 1 else rng.choice(WORDS) for i in range(words))
+        return text[0].upper() + text[1:] + "."
+
+    def _origin(self, idx):
+        # Wire copies reuse the original story's text
+        if self.syndicate_every and idx % self.syndicate_every == 1 and idx > 0:
+            return idx - 1
+        return idx
+
+    def title(self, idx):
+        if self.files:
+            return os.path.splitext(self.files[idx])[0].replace("-", " ").replace("_", " ")
+        rng = random.Random(_stable_hash(self.seed, "title", self._origin(idx)))
+        title = self._sentence(rng, rng.randint(6, 11))[:-1]
+        return title + " - Wire" if self._origin(idx) != idx else title
+
+    def slug(self, idx):
+        return self.files[idx] if self.files else f"story-{idx}.html"
+
+    def index_of(self, slug):
+        if self.files:
+            return self.files.index(slug) if slug in self.files else None
+        try:
+            idx = int(slug[len("story-"):-len(".html")])
+        except ValueError:
+            return None
+        return idx if 0 <= idx < self.size else None
+
+    def html(self, idx):
+        if self.files:
+            with open(os.path.join(self.html_dir, self.files[idx]), "rb") as f:
+                return f.read()
+        rng = random.Random(_stable_hash(self.seed, "body", self._origin(idx)))
+        title = self.title(idx)
+        paragraphs = ["<p>" + " ".join(self._sentence(rng, prose=True) for _ in range(rng.randint(3, 6))) + "</p>"
+                      for _ in range(rng.randint(6, 14))]
+        return (f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>{title}</title>"
+                f"<meta property=\"og:title\" content=\"{title}\"></head><body>"
+                f"<nav><a href=\"/\">Home</a> <a href=\"/markets\">Markets</a></nav>"
+                f"<article><h1>{title}</h1><p class=\"byline\">By Staff Reporter</p>{''.join(paragraphs)}</article>"
+                f"<footer>Copyright Fake Wire</footer></body></html>").encode("utf-8")
+
+#---------------------------------------------------------------------------------------------------------------------------
+class _Handler(BaseHTTPRequestHandler):
+    """Base for the HTTP fakes: counted I/O, keep-alive, JSON helpers."""
+    protocol_version = "HTTP/1.1"
+    service = None
+    counters = None
+    fault = None
+
+    def setup(self):
+        super().setup()
+        self.rfile = _Counted(self.rfile, self.counters, self.service, "bytes_in")
+        self.wfile = _Counted(self.wfile, self.counters, self.service, "bytes_out")
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status, body, content_type="application/json", headers=None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_cached(self, body, content_type):
+        """200 with an ETag and Last-Modified, or 304 when the client's validators still match."""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        validators = {"ETag": etag, "Last-Modified": LAST_MODIFIED}
+        if self.headers.get("If-None-Match") == etag or (not self.headers.get("If-None-Match")
+                                                         and self.headers.get("If-Modified-Since") == LAST_MODIFIED):
+            self.send_response(304)
+            for key, value in validators.items():
+                self.send_header(key, value)
+            self.end_headers()
+            return
+        self.send_body(200, body, content_type, validators)
+
+    def begin(self, inject=True):
+        """Count the request, apply latency and return True when an error should be injected."""
+        self.counters.add(self.service, "requests")
+        if self.headers.get("Content-Length"):
+            self.rfile.read(int(self.headers["Content-Length"]))
+        self.fault.delay()
+        if inject and self.fault.fail():
+            self.counters.add(self.service, "errors_injected")
+            return True
+        return False
+
+class TrendsHandler(_Handler):
+    service = "trends"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.startswith(TRENDS_PREFIX + "/explore"):
+            # Cookie page; pytrends fetches it before every request when it uses proxies
+            self.begin(inject=False)
+            self.send_body(200, "<html></html>", "text/html", {"Set-Cookie": "NID=511=fake; Path=/"})
+        elif url.path == TRENDS_PREFIX + "/api/widgetdata/multiline":
+            if self.begin():
+                return self.send_body(429, "Too Many Requests", "text/html")
+            request = json.loads(query.get("req", ["{}"])[0])
+            self.send_body(200, ")]}',\n" + json.dumps(self.timeline(request.get("keywords", []))))
+        else:
+            self.begin(inject=False)
+            self.send_body(404, "{}")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != TRENDS_PREFIX + "/api/explore":
+            self.begin(inject=False)
+            return self.send_body(404, "{}")
+        if self.begin():
+            return self.send_body(429, "Too Many Requests", "text/html")
+        request = json.loads(parse_qs(url.query).get("req", ["{}"])[0])
+        items = request.get("comparisonItem", [])
+        widget_request = {"keywords": [item.get("keyword", "") for item in items],
+                          "geo": items[0].get("geo", "") if items else ""}
+        widgets = [{"id": "TIMESERIES", "request": widget_request, "token": "fake-token"},
+                   {"id": "GEO_MAP", "request": widget_request, "token": "fake-token"}]
+        self.send_body(200, ")]}'" + json.dumps({"widgets": widgets}))
+
+    @staticmethod
+    def timeline(keywords, points=24):
+        # Some keywords have no data at all; the rest follow a keyword-specific level with hourly noise,
+        # and the payload is normalized to a peak of 100 like Google does
+        raw = []
+        for kw in keywords:
+            level = _stable_hash("level", kw) % 100
+            if level < 15:
+                raw.append([0] * points)
+                continue
+            raw.append([level + (_stable_hash("noise", kw, i) % 30) for i in range(points)])
+        peak = max((max(series) for series in raw), default=0) or 1
+        start = int(time.time()) - points * 3600
+        rows = [{"time": str(start + i * 3600), "formattedTime": "", "formattedAxisTime": "",
+                 "value": [round(series[i] * 100 / peak) for series in raw],
+                 "hasData": [series[i] > 0 for series in raw], "formattedValue": [], "isPartial": i == points - 1}
+                for i in range(points)]
+        return {"default": {"timelineData": rows, "averages": []}}
+
+class NewsAPIHandler(_Handler):
+    service = "newsapi"
+    corpus = None
+    html_base = ""
+    country_codes = ()
+    sources_per_country = 2
+    max_results = 12  # per query
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if self.begin():
+            return self.send_body(429, json.dumps({"status": "error", "code": "rateLimited",
+                                                   "message": "You have made too many requests recently."}))
+        if not query.get("apiKey"):
+            return self.send_body(401, json.dumps({"status": "error", "code": "apiKeyMissing"}))
+        if url.path == "/v2/sources":
+            self.send_cached(json.dumps({"status": "ok", "sources": self.sources()}), "application/json")
+        elif url.path == "/v2/everything":
+            if int(query.get("page", 1)) * int(query.get("pageSize", 100)) > 100:
+                # Developer plans stop at the first 100 results of a query
+                return self.send_body(426, json.dumps({"status": "error", "code": "maximumResultsReached"}))
+            self.send_body(200, json.dumps(self.everything(query)))
+        else:
+            self.send_body(404, json.dumps({"status": "error", "code": "routeNotFound"}))
+
+    def sources(self):
+        return [{"id": f"{code.lower()}-daily-{i}", "name": f"{code} Daily {i}", "description": "",
+                 "url": "", "category": "business", "language": "en", "country": code.lower()}
+                for code in self.country_codes for i in range(self.sources_per_country)]
+
+    @staticmethod
+    def subqueries(q):
+        # "(country) AND ((phrase 1) OR (phrase 2))" matches what "country phrase 1" or "country phrase 2" would
+        batched = re.match(r"^\((.*?)\) AND \((.*)\)$", q)
+        if not batched:
+            return [q]
+        return [f"{batched.group(1)} {phrase}" for phrase in re.findall(r"\(([^()]*)\)", batched.group(2))]
+
+    def everything(self, query):
+        # Publish times are fixed per (query, rank) for the day, and `from` is honoured like the real API,
+        # so incremental fetching sees the same articles again on a second run
+        q = query.get("q", "")
+        page_size = max(1, min(int(query.get("pageSize", 100)), 100))
+        page = max(1, int(query.get("page", 1)))
+        since = query.get("from", "")
+        day = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        found = {}
+        for sub in self.subqueries(q):
+            key = " ".join(re.findall(r"[a-z0-9]+", sub.lower()))
+            for rank in range(_stable_hash("total", key) % (self.max_results + 1)):
+                published = (day - timedelta(minutes=_stable_hash("age", key, rank) % (14 * 24 * 60)))
+                published = published.strftime("%Y-%m-%dT%H:%M:%SZ")
+                idx = _stable_hash("story", key, rank) % self.corpus.size
+                if published[:len(since)] >= since and idx not in found:
+                    found[idx] = (published, idx, sub)
+        matches = sorted(found.values(), reverse=True)
+        articles = [{
+            "source": {"id": None, "name": "Fake Wire"},
+            "author": "Staff Reporter",
+            "title": self.corpus.title(idx),
+            "description": f"Coverage of {sub}.",
+            "url": f"{self.html_base}/article/{self.corpus.slug(idx)}",
+            "publishedAt": published,
+            "content": "",
+        } for published, idx, sub in matches[(page - 1) * page_size:page * page_size]]
+        return {"status": "ok", "totalResults": len(matches), "articles": articles}
+
+class ArticleHandler(_Handler):
+    service = "html"
+    corpus = None
+
+    def do_GET(self):
+        path = unquote(urlparse(self.path).path)
+        if self.begin():
+            return self.send_body(503, "<html>Service Unavailable</html>", "text/html")
+        idx = self.corpus.index_of(path.rsplit("/", 1)[-1]) if path.startswith("/article/") else None
+        if idx is None:
+            return self.send_body(404, "<html>Not Found</html>", "text/html")
+        self.send_cached(self.corpus.html(idx), "text/html; charset=utf-8")
+
+class AdminHandler(BaseHTTPRequestHandler):
+    counters = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = json.dumps(self.counters.snapshot()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+#---------------------------------------------------------------------------------------------------------------------------
+# Tor stand-in: SOCKS5 with username/password circuit isolation, and a control port
+class TorState:
+    def __init__(self):
+        self.epoch = 0  # bumped by SIGNAL NEWNYM; every circuit gets a new exit IP
+        self._lock = threading.Lock()
+
+    def newnym(self):
+        with self._lock:
+            self.epoch += 1
+
+    def exit_ip(self, username):
+        h = _stable_hash("exit", username, self.epoch)
+        return f"10.{h % 250 + 1}.{(h >> 8) % 256}.{(h >> 16) % 254 + 1}"
+
+class SocksHandler(socketserver.BaseRequestHandler):
+    counters = None
+    fault = None
+    state = None
+    ip_check_hosts = ("httpbin.org",)
+
+    def _recv(self, n):
+        data = b""
+        while len(data) < n:
+            chunk = self.request.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("client went away")
+            data += chunk
+        return data
+
+    def handle(self):
+        try:
+            username = self._negotiate()
+            if username is None:
+                return
+            host, port = self._read_connect()
+        except (ConnectionError, OSError, struct.error):
+            return
+        self.counters.add("tor", "connections")
+        self.counters.circuit(username)
+        self.fault.delay()
+        if self.fault.fail():
+            self.counters.add("tor", "errors_injected")
+            return self.request.sendall(b"\x05\x01\x00\x01\x00\x00\x00\x00\x00\x00")  # general failure
+        if host in self.ip_check_hosts:
+            self.request.sendall(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+            return self._answer_ip_check(username)
+        try:
+            upstream = socket.create_connection((host, port), timeout=10)
+        except OSError:
+            return self.request.sendall(b"\x05\x05\x00\x01\x00\x00\x00\x00\x00\x00")  # connection refused
+        self.request.sendall(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+        self._relay(upstream)
+
+    def _negotiate(self):
+        version, nmethods = self._recv(2)
+        methods = self._recv(nmethods)
+        if version != 5:
+            return None
+        if 2 not in methods:
+            self.request.sendall(b"\x05\x00")
+            return ""
+        self.request.sendall(b"\x05\x02")
+        _, ulen = self._recv(2)
+        username = self._recv(ulen).decode("utf-8", "replace")
+        plen = self._recv(1)[0]
+        self._recv(plen)
+        self.request.sendall(b"\x01\x00")
+        return username
+
+    def _read_connect(self):
+        _, cmd, _, atyp = self._recv(4)
+        if atyp == 1:
+            host = socket.inet_ntoa(self._recv(4))
+        elif atyp == 3:
+            host = self._recv(self._recv(1)[0]).decode("idna")
+        else:
+            host = socket.inet_ntop(socket.AF_INET6, self._recv(16))
+        port = struct.unpack("!H", self._recv(2))[0]
+        if cmd != 1:
+            self.request.sendall(b"\x05\x07\x00\x01\x00\x00\x00\x00\x00\x00")
+            raise ConnectionError("only CONNECT is supported")
+        return host, port
+
+    def _answer_ip_check(self, username):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            chunk = self.request.recv(4096)
+            if not chunk:
+                return
+            request += chunk
+        body = json.dumps({"origin": self.state.exit_ip(username)}).encode("utf-8")
+        response = (b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n"
+                    b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+        self.counters.add("tor", "bytes_in", len(request))
+        self.counters.add("tor", "bytes_out", len(response))
+        self.request.sendall(response)
+
+    def _relay(self, upstream):
+        sockets = [self.request, upstream]
+        try:
+            while True:
+                readable, _, _ = select.select(sockets, [], [], 60)
+                if not readable:
+                    return
+                for sock in readable:
+                    data = sock.recv(65536)
+                    if not data:
+                        return
+                    if sock is self.request:
+                        self.counters.add("tor", "bytes_in", len(data))
+                        upstream.sendall(data)
+                    else:
+                        self.counters.add("tor", "bytes_out", len(data))
+                        self.request.sendall(data)
+        except OSError:
+            return
+        finally:
+            upstream.close()
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    """Just enough of Tor's control protocol for stem: PROTOCOLINFO, AUTHENTICATE, SIGNAL NEWNYM, GETINFO."""
+    counters = None
+    state = None
+
+    def reply(self, *lines):
+        for line in lines[:-1]:
+            self.wfile.write(f"250-{line}\r\n".encode("utf-8"))
+        self.wfile.write(f"250 {lines[-1]}\r\n".encode("utf-8"))
+
+    def handle(self):
+        for raw in self.rfile:
+            command = raw.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb == "PROTOCOLINFO":
+                self.reply("PROTOCOLINFO 1", "AUTH METHODS=HASHEDPASSWORD", 'VERSION Tor="0.4.8.12"', "OK")
+            elif verb == "SIGNAL" and command.upper().endswith("NEWNYM"):
+                self.state.newnym()
+                self.counters.add("tor", "newnym")
+                self.reply("OK")
+            elif verb == "GETINFO":
+                keys = command.split()[1:]
+                self.reply(*[f"{key}=0.4.8.12" if key == "version" else f"{key}=" for key in keys], "OK")
+            elif verb == "QUIT":
+                self.wfile.write(b"250 closing connection\r\n")
+                return
+            else:
+                self.reply("OK")
+
+#---------------------------------------------------------------------------------------------------------------------------
+class SmtpHandler(socketserver.StreamRequestHandler):
+    """SMTP sink: EHLO, STARTTLS, AUTH PLAIN/LOGIN, MAIL, RCPT, DATA. Messages are counted and dropped."""
+    counters = None
+    fault = None
+    tls_context = None
+
+    def send(self, line):
+        data = (line + "\r\n").encode("utf-8")
+        self.counters.add("smtp", "bytes_out", len(data))
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def readline(self):
+        line = self.rfile.readline()
+        self.counters.add("smtp", "bytes_in", len(line))
+        return line
+
+    def handle(self):
+        tls = False
+        self.send("220 sink.local ESMTP")
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                features = ["sink.local", "8BITMIME", "AUTH PLAIN LOGIN"]
+                if self.tls_context is not None and not tls:
+                    features.insert(1, "STARTTLS")
+                for feature in features[:-1]:
+                    self.send(f"250-{feature}")
+                self.send(f"250 {features[-1]}")
+            elif verb == "STARTTLS" and self.tls_context is not None:
+                self.send("220 Ready to start TLS")
+                self.connection = self.tls_context.wrap_socket(self.connection, server_side=True)
+                self.rfile = self.connection.makefile("rb")
+                self.wfile = self.connection.makefile("wb")
+                tls = True
+            elif verb == "AUTH":
+                parts = command.split()
+                if len(parts) == 2 and parts[1].upper() == "PLAIN":
+                    self.send("334 ")
+                    self.readline()
+                elif len(parts) >= 2 and parts[1].upper() == "LOGIN":
+                    if len(parts) == 2:
+                        self.send("334 VXNlcm5hbWU6")  # "Username:"
+                        self.readline()
+                    self.send("334 UGFzc3dvcmQ6")  # "Password:"
+                    self.readline()
+                self.send("235 2.7.0 Authentication successful")
+            elif verb == "DATA":
+                self.send("354 End data with <CR><LF>.<CR><LF>")
+                while self.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                self.counters.add("smtp", "requests")
+                self.fault.delay()
+                if self.fault.fail():
+                    self.counters.add("smtp", "errors_injected")
+                    self.send("451 4.3.0 Temporary failure, try again later")
+                else:
+                    self.send("250 2.0.0 Queued")
+            elif verb == "QUIT":
+                self.send("221 Bye")
+                return
+            else:
+                self.send("250 OK")
+
+#---------------------------------------------------------------------------------------------------------------------------
+def make_certificate(directory):
+    """Self-signed certificate for localhost (needs the openssl CLI). Returns (cert_path, key_path)."""
+    cert, key = os.path.join(directory, "fake-cert.pem"), os.path.join(directory, "fake-key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", cert,
+                    "-days", "2", "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1"],
+                   check=True, capture_output=True)
+    return cert, key
+
+def _handler(base, **attrs):
+    return type(base.__name__, (base,), attrs)
+
+def _serve(server):
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+def serve(config):
+    """Start every fake in this process; returns {service: port} (plus "tor_control" and "admin")."""
+    counters = Counters()
+    latency = dict(DEFAULT_LATENCY, **config.get("latency", {}))
+    errors = config.get("errors", {})
+    faults = {name: Fault(latency.get(name, 0.0), config.get("jitter", 0.5), errors.get(name, 0.0), seed=i)
+              for i, name in enumerate(SERVICES)}
+    corpus = Corpus(size=config.get("corpus_size", 400), html_dir=config.get("corpus_dir"))
+    cert, key = config["cert"], config["key"]
+    tls_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    tls_context.load_cert_chain(cert, key)
+    ports = {}
+
+    html = ThreadingHTTPServer(("127.0.0.1", 0), _handler(ArticleHandler, counters=counters, fault=faults["html"],
+                                                          corpus=corpus))
+    ports["html"] = _serve(html)
+
+    newsapi = ThreadingHTTPServer(("127.0.0.1", 0), _handler(
+        NewsAPIHandler, counters=counters, fault=faults["newsapi"], corpus=corpus,
+        html_base=f"http://127.0.0.1:{ports['html']}", country_codes=tuple(config.get("country_codes", ()))))
+    ports["newsapi"] = _serve(newsapi)
+
+    trends = ThreadingHTTPServer(("127.0.0.1", 0), _handler(TrendsHandler, counters=counters, fault=faults["trends"]))
+    trends.socket = tls_context.wrap_socket(trends.socket, server_side=True)
+    ports["trends"] = _serve(trends)
+
+    state = TorState()
+    socks = _ThreadingTCPServer(("127.0.0.1", 0), _handler(SocksHandler, counters=counters, fault=faults["tor"],
+                                                           state=state))
+    ports["tor"] = _serve(socks)
+    control = _ThreadingTCPServer(("127.0.0.1", 0), _handler(ControlHandler, counters=counters, state=state))
+    ports["tor_control"] = _serve(control)
+
+    smtp = _ThreadingTCPServer(("127.0.0.1", 0), _handler(SmtpHandler, counters=counters, fault=faults["smtp"],
+                                                          tls_context=tls_context))
+    ports["smtp"] = _serve(smtp)
+
+    admin = ThreadingHTTPServer(("127.0.0.1", 0), _handler(AdminHandler, counters=counters))
+    ports["admin"] = _serve(admin)
+    return ports
+
+class FakeServices:
+    """Handle on the fakes' child process."""
+
+    def __init__(self, proc, ports):
+        self.proc = proc
+        self.ports = ports
+
+    @property
+    def pid(self):
+        return self.proc.pid
+
+    def stats(self):
+        from urllib.request import urlopen
+        with urlopen(f"http://127.0.0.1:{self.ports['admin']}/stats", timeout=10) as response:
+            return json.load(response)
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.stdin.close()
+            try:
+                self.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+def start(config):
+    """Run `serve(config)` in a child process and return a FakeServices handle once it listens."""
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__)], stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, text=True)
+    proc.stdin.write(json.dumps(config) + "\n")
+    proc.stdin.flush()
+    line = proc.stdout.readline()
+    if not line:
+        raise RuntimeError("Fake services failed to start.")
+    return FakeServices(proc, json.loads(line)["ports"])
+
+if __name__ == "__main__":
+    ports = serve(json.loads(sys.stdin.readline()))
+    print(json.dumps({"ports": ports}), flush=True)
+    sys.stdin.read()  # serve until the parent closes our stdin
@@ -1,63 +1,67 @@
-import requests
 import csv
-import smtplib
 import os
-import pandas as pd
 import random
 import time
 import json
 import pickle
 import shutil
-from email.mime.text import MIMEText
+import sqlite3
+import hashlib
+import glob
+import re
+import uuid
+import threading
 from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
-from pytrends.request import TrendReq
-from stem import Signal
-from stem.control import Controller
-from newspaper import Article
 from collections import defaultdict
 from collections import deque
-import nltk
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from urllib.parse import urlparse, urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Heavy libraries (requests, pandas, pyarrow, pytrends, stem, newspaper/nltk, smtplib) are imported inside
+# the functions that use them, so importing this module stays fast and free of side effects.
 
 # Debug prints to check directory status
 #print(f"SMTP_HOST: {os.getenv('SMTP_HOST')}")
 #print(f"TOR_PROXY: {os.getenv('TOR_PROXY')}")
 
     
-CACHE_FILENAME = "current.pkl"
-MAX_CACHE_SIZE = 1000
+CACHE_DIR = "news_cache"
+CACHE_FILENAME = "current.pkl"  # legacy pickle cache, migrated into ARTICLE_DB_FILENAME
+ARTICLE_DB_FILENAME = "articles.db"
+ARCHIVE_DIRNAME = "archive"  # columnar quarterly archive: archive/year=YYYY/quarter=Q/part-*.parquet
 
 def get_quarter(date_obj):
     return (date_obj.month - 1) // 3 + 1
 
-# Set the path if the environment variable is defined
-if 'NLTK_DATA' in os.environ:
-    nltk.data.path.append(os.environ['NLTK_DATA'])
-
 #---------------------------------------------------------------------------------------------------------------------------
-# Load environment variables from .env file (useful for local testing)
+# Load environment variables from .env file (useful for local testing). This only fills in variables that
+# are not already set; nothing is validated until the runtime config is first used.
 load_dotenv()
 
-# Set pandas option to suppress future warnings
-pd.set_option('future.no_silent_downcasting', True)
-
-API_KEY = os.getenv("NEWS_API_KEY")
-EMAIL_HOST = os.getenv("EMAIL_HOST")
-EMAIL_PORT = int(os.getenv("EMAIL_PORT", 587))
-EMAIL_USER = os.getenv("EMAIL_USER")
-EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
-EMAIL_TO = os.getenv("EMAIL_TO")
-
 # List the required environment variables
 required_env = ["NEWS_API_KEY", "EMAIL_HOST", "EMAIL_PORT", "EMAIL_USER", "EMAIL_PASSWORD", "EMAIL_TO"]
 
-# Check for missing variables
-missing_vars = [var for var in required_env if not os.getenv(var)]
-if missing_vars:
-    raise EnvironmentError(f"Missing the following environment variables: {', '.join(missing_vars)}")
-
+TOR_PROXY = 'socks5h://127.0.0.1:9050'
+TOR_CONTROL_PORT = int(os.getenv("TOR_CONTROL_PORT", 9051))
 
+def _pandas():
+    import pandas as pd
+    # Set pandas option to suppress future warnings
+    pd.set_option('future.no_silent_downcasting', True)
+    return pd
 
+def _newspaper():
+    import nltk
+    # Set the path if the environment variable is defined
+    if 'NLTK_DATA' in os.environ and os.environ['NLTK_DATA'] not in nltk.data.path:
+        nltk.data.path.append(os.environ['NLTK_DATA'])
+    import newspaper
+    import newspaper.article
+    import newspaper.network
+    return newspaper
 
 #---------------------------------------------------------------------------------------------------------------------------
 def load_country_phrases(filepath="phrases.txt"):
@@ -73,21 +77,195 @@ def load_country_phrases(filepath="phrases.txt"):
         print(f"[ERROR] Could not find {filepath}.")
     return country_phrase_map
 #---------------------------------------------------------------------------------------------------------------------------
+class Runtime:
+    """
+    Settings that used to be loaded at import time. Each one is built on first use: credentials are
+    validated when a stage needs them and phrases.txt is parsed when the phrase list is needed.
+    (Tor-bound TrendReq sessions are created per circuit by CircuitPool when the Trends stage runs.)
+    """
+
+    def __init__(self, phrases_path="phrases.txt"):
+        self.phrases_path = phrases_path
+        self._config = None
+        self._country_phrase_map = None
 
-# Load country-phrase mapping
-country_phrase_map = load_country_phrases()
-if not country_phrase_map:
-    raise ValueError("No phrases loaded. Ensure 'phrases.txt' contains valid entries.")
-countries = list(country_phrase_map.keys())
+    @property
+    def config(self):
+        if self._config is None:
+            # Check for missing variables
+            missing_vars = [var for var in required_env if not os.getenv(var)]
+            if missing_vars:
+                raise EnvironmentError(f"Missing the following environment variables: {', '.join(missing_vars)}")
+            self._config = {
+                "API_KEY": os.getenv("NEWS_API_KEY"),
+                "EMAIL_HOST": os.getenv("EMAIL_HOST"),
+                "EMAIL_PORT": int(os.getenv("EMAIL_PORT", 587)),
+                "EMAIL_USER": os.getenv("EMAIL_USER"),
+                "EMAIL_PASSWORD": os.getenv("EMAIL_PASSWORD"),
+                "EMAIL_TO": os.getenv("EMAIL_TO"),
+            }
+        return self._config
 
+    @property
+    def country_phrase_map(self):
+        if self._country_phrase_map is None:
+            # Load country-phrase mapping
+            country_phrase_map = load_country_phrases(self.phrases_path)
+            if not country_phrase_map:
+                raise ValueError("No phrases loaded. Ensure 'phrases.txt' contains valid entries.")
+            self._country_phrase_map = country_phrase_map
+        return self._country_phrase_map
 
-# Initialize pytrends with Tor
-proxy_list = ['socks5h://127.0.0.1:9050']
-pytrends = TrendReq(proxies=proxy_list, timeout=(20, 40))  # (connect, read)
+    @property
+    def countries(self):
+        return list(self.country_phrase_map.keys())
+
+runtime = Runtime()
+
+_RUNTIME_ATTRIBUTES = {"country_phrase_map", "countries"}
+_CONFIG_ATTRIBUTES = {"API_KEY", "EMAIL_HOST", "EMAIL_PORT", "EMAIL_USER", "EMAIL_PASSWORD", "EMAIL_TO"}
+
+def __getattr__(name):
+    # Keep the old module-level names (news_scraper.countries, news_scraper.API_KEY, ...) working, lazily
+    if name in _RUNTIME_ATTRIBUTES:
+        return getattr(runtime, name)
+    if name in _CONFIG_ATTRIBUTES:
+        return runtime.config[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 #---------------------------------------------------------------------------------------------------------------------------
+# Run instrumentation: timing spans around stages and external calls, plus counters (cache hits, retries,
+# 429s, rotations, paced sleep). Every finished stage appends one JSON line to news_cache/metrics/<run_id>.jsonl,
+# so a resumed run still adds up to one complete record; PROMETHEUS_TEXTFILE (a node_exporter textfile
+# collector path) additionally gets the latest run's numbers.
+METRICS_DIR = os.path.join(CACHE_DIR, "metrics")
+PROMETHEUS_TEXTFILE = os.getenv("PROMETHEUS_TEXTFILE")
+
+class Metrics:
+    """Thread-safe span and counter aggregates for the stage that is currently running."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.spans = {}     # name → {"count", "seconds", "max"}
+            self.counters = defaultdict(float)
+
+    def record(self, name, seconds):
+        with self._lock:
+            span = self.spans.setdefault(name, {"count": 0, "seconds": 0.0, "max": 0.0})
+            span["count"] += 1
+            span["seconds"] += seconds
+            span["max"] = max(span["max"], seconds)
+
+    @contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def snapshot(self):
+        with self._lock:
+            spans = {name: {"count": s["count"], "seconds": round(s["seconds"], 3), "max": round(s["max"], 3)}
+                     for name, s in self.spans.items()}
+            counters = {name: round(value, 3) for name, value in self.counters.items()}
+            return spans, counters
+
+metrics = Metrics()
+
+def _metrics_path(run_id, shard=None):
+    if shard is not None:
+        return os.path.join(_run_dir(run_id, shard), "metrics.jsonl")
+    return os.path.join(METRICS_DIR, f"{run_id}.jsonl")
+
+def append_metrics_records(run_id, records, shard=None):
+    path = _metrics_path(run_id, shard)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+def write_stage_metrics(run_id, stage, seconds, status="ok", shard=None):
+    """Append the stage's record (wall time, spans, counters) to the run's metrics file and start afresh."""
+    spans, counters = metrics.snapshot()
+    metrics.reset()
+    record = {"run_id": run_id, "stage": stage, "status": status, "seconds": round(seconds, 3),
+              "finished_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+              "spans": spans, "counters": counters}
+    append_metrics_records(run_id, [record], shard)
+
+def read_metrics_records(run_id, shard=None):
+    records = []
+    try:
+        with open(_metrics_path(run_id, shard), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # a line cut short by a crash
+    except FileNotFoundError:
+        pass
+    return records
+
+def load_run_metrics(run_id, shard=None):
+    """Fold a run's stage records into {"stages": {stage: seconds}, "spans": ..., "counters": ...}; the latest attempt of a stage wins."""
+    latest = {record["stage"]: record for record in read_metrics_records(run_id, shard)}
+
+    summary = {"stages": {}, "spans": {}, "counters": defaultdict(float)}
+    for stage, record in latest.items():
+        summary["stages"][stage] = record["seconds"]
+        for name, span in record["spans"].items():
+            total = summary["spans"].setdefault(name, {"count": 0, "seconds": 0.0, "max": 0.0})
+            total["count"] += span["count"]
+            total["seconds"] += span["seconds"]
+            total["max"] = max(total["max"], span["max"])
+        for name, value in record["counters"].items():
+            summary["counters"][name] += value
+    summary["counters"] = dict(summary["counters"])
+    return summary
+
+def _prometheus_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+def write_prometheus_textfile(run_id, path=None):
+    """Export the run's metrics in the Prometheus text format, atomically (node_exporter reads the file any time)."""
+    path = path or PROMETHEUS_TEXTFILE
+    if not path:
+        return
+    summary = load_run_metrics(run_id)
+    lines = ["# HELP news_engine_stage_seconds Wall time of each stage in the latest run.",
+             "# TYPE news_engine_stage_seconds gauge"]
+    lines += [f'news_engine_stage_seconds{{stage="{stage}"}} {seconds}' for stage, seconds in summary["stages"].items()]
+    lines += ["# HELP news_engine_call_seconds Total time spent in each kind of external call in the latest run.",
+              "# TYPE news_engine_call_seconds gauge"]
+    lines += [f'news_engine_call_seconds{{call="{name}"}} {round(span["seconds"], 3)}'
+              for name, span in summary["spans"].items()]
+    lines += ["# HELP news_engine_calls Number of calls of each kind in the latest run.",
+              "# TYPE news_engine_calls gauge"]
+    lines += [f'news_engine_calls{{call="{name}"}} {span["count"]}' for name, span in summary["spans"].items()]
+    for name, value in sorted(summary["counters"].items()):
+        metric = f"news_engine_{_prometheus_name(name)}"
+        lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+    lines += ["# HELP news_engine_last_run_timestamp_seconds When the latest run's metrics were exported.",
+              "# TYPE news_engine_last_run_timestamp_seconds gauge",
+              f"news_engine_last_run_timestamp_seconds {int(time.time())}"]
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
 #---------------------------------------------------------------------------------------------------------------------------
-def get_current_tor_ip(timeout=10):
-    proxies = {'http': 'socks5h://127.0.0.1:9050', 'https': 'socks5h://127.0.0.1:9050'}
+def get_current_tor_ip(timeout=10, proxy=TOR_PROXY):
+    import requests
+    proxies = {'http': proxy, 'https': proxy}
     
     try:
         return requests.get('http://httpbin.org/ip', proxies=proxies, timeout=timeout).json()['origin']
@@ -96,12 +274,15 @@ def get_current_tor_ip(timeout=10):
         return None
 #---------------------------------------------------------------------------------------------------------------------------
 def rotate_tor_ip(max_retries=5, wait_time=10):
+    from stem import Signal
+    from stem.control import Controller
+
     old_ip = get_current_tor_ip()
     if old_ip is None:
         print("[WARN] Cannot fetch old IP, skipping validation.")
     
     for attempt in range(max_retries):
-        with Controller.from_port(port=9051) as controller:
+        with Controller.from_port(port=TOR_CONTROL_PORT) as controller:
             controller.authenticate(password="no_hurry_in_2025")
             controller.signal(Signal.NEWNYM)
         print(f"[INFO] Sent NEWNYM signal. Waiting {wait_time}s...")
@@ -120,6 +301,258 @@ def rotate_tor_ip(max_retries=5, wait_time=10):
     print("[ERROR] Failed to rotate Tor IP after max retries.")
     raise Exception("Tor IP rotation failed.")
 #---------------------------------------------------------------------------------------------------------------------------
+# Adaptive request pacing (AIMD) shared by the Trends and NewsAPI clients. The delay between requests
+# backs off multiplicatively on a 429 and creeps up on slow responses, and shrinks additively while the
+# endpoint answers quickly, so we run as fast as the endpoint tolerates instead of sleeping a fixed
+# random 10-25s. Every delay is jittered so parallel workers do not fire in lockstep.
+TRENDS_MIN_DELAY = float(os.getenv("TRENDS_MIN_DELAY", 4))
+TRENDS_MAX_DELAY = float(os.getenv("TRENDS_MAX_DELAY", 120))
+TRENDS_ROTATE_ERROR_RATE = float(os.getenv("TRENDS_ROTATE_ERROR_RATE", 0.5))  # 429 share that renews a circuit
+NEWSAPI_MAX_DELAY = 60
+
+class PacingController:
+    """
+    Thread-safe AIMD pacer. Call `record()` after every request; `next_delay()` gives the jittered
+    pause before the next one and `wait()` sleeps it. `should_rotate()` turns True when the share of
+    failed requests (429, 5xx or transport errors) in the last `window` requests reaches `rotate_error_rate`.
+    """
+
+    def __init__(self, name, min_delay=0.0, max_delay=60.0, initial_delay=None, step=1.0, backoff=2.0,
+                 latency_target=None, jitter=0.25, window=8, rotate_error_rate=0.5, min_samples=3):
+        self.name = name
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = min_delay if initial_delay is None else initial_delay
+        self.step = step
+        self.backoff = backoff
+        self.latency_target = latency_target
+        self.jitter = jitter
+        self.rotate_error_rate = rotate_error_rate
+        self.min_samples = min_samples
+        self.requests = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.transport_errors = 0
+        self.rotations = 0
+        self.sleep_total = 0.0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency=None, rate_limited=False, server_error=False, transport_error=False):
+        """
+        Feed back one request: a 429, a 5xx or a transport error (no response at all) multiplies the delay,
+        a slow answer adds a step, anything else subtracts one.
+        """
+        with self._lock:
+            self.requests += 1
+            failed = rate_limited or server_error or transport_error
+            self._recent.append(bool(failed))
+            if failed:
+                if rate_limited:
+                    self.rate_limited += 1
+                    metrics.incr(f"{self.name}.rate_limited")
+                elif server_error:
+                    self.server_errors += 1
+                    metrics.incr(f"{self.name}.server_errors")
+                else:
+                    self.transport_errors += 1
+                    metrics.incr(f"{self.name}.transport_errors")
+                self.delay = min(self.max_delay, max(self.delay, self.step) * self.backoff)
+            elif self.latency_target and latency is not None and latency > self.latency_target:
+                self.delay = min(self.max_delay, self.delay + self.step)
+            else:
+                self.delay = max(self.min_delay, self.delay - self.step)
+
+    def next_delay(self, floor=0.0):
+        """Jittered delay before the next request (at least `floor`, e.g. a Retry-After); counted as sleep time."""
+        with self._lock:
+            delay = max(self.delay, floor)
+            if delay > 0:
+                delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+            self.sleep_total += delay
+            metrics.incr(f"{self.name}.sleep_seconds", delay)
+            return delay
+
+    def wait(self, floor=0.0):
+        delay = self.next_delay(floor)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def error_rate(self):
+        with self._lock:
+            return sum(self._recent) / len(self._recent) if self._recent else 0.0
+
+    def should_rotate(self):
+        with self._lock:
+            return len(self._recent) >= self.min_samples and \
+                sum(self._recent) / len(self._recent) >= self.rotate_error_rate
+
+    def rotated(self):
+        """Count a rotation and start the error window over for the new identity."""
+        with self._lock:
+            self.rotations += 1
+            metrics.incr(f"{self.name}.rotations")
+            self._recent.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "rate_limited": self.rate_limited, "server_errors": self.server_errors,
+                    "transport_errors": self.transport_errors, "rotations": self.rotations, "sleep_seconds": round(self.sleep_total, 1),
+                    "delay": round(self.delay, 2)}
+
+def merge_pacing_stats(stats_list):
+    """Sum per-controller stats (e.g. one per Tor circuit) into one run-level record."""
+    merged = {"requests": 0, "rate_limited": 0, "server_errors": 0, "transport_errors": 0, "rotations": 0,
+              "sleep_seconds": 0.0}
+    for stats in stats_list:
+        for key in merged:
+            merged[key] += stats.get(key, 0)
+    merged["sleep_seconds"] = round(merged["sleep_seconds"], 1)
+    return merged
+
+def format_pacing_stats(name, stats):
+    return (f"{name}: {stats['requests']} requests, {stats['rate_limited']}× 429, "
+            f"{stats.get('server_errors', 0)}× 5xx, {stats.get('transport_errors', 0)} transport errors, "
+            f"{stats['rotations']} rotations, {stats['sleep_seconds']:.0f}s paced")
+
+def new_trends_pacer():
+    return PacingController("trends", min_delay=TRENDS_MIN_DELAY, max_delay=TRENDS_MAX_DELAY,
+                            initial_delay=TRENDS_MIN_DELAY * 2, step=1.0, backoff=2.0, latency_target=15,
+                            rotate_error_rate=TRENDS_ROTATE_ERROR_RATE)
+
+pacing_stats = {}  # client name → stats of the current run, picked up by the stage checkpoints
+#---------------------------------------------------------------------------------------------------------------------------
+# Pool of isolated Tor circuits for parallel Trends lookups. Tor's SocksPort isolates streams by SOCKS
+# credentials (IsolateSOCKSAuth is on by default), so every circuit is just a fresh username on one of the
+# configured SocksPorts. Renewing a circuit means switching credentials, which no other worker notices,
+# instead of sending a NEWNYM that resets every circuit at once.
+TRENDS_CIRCUITS = int(os.getenv("TRENDS_CIRCUITS", 4))
+TRENDS_MAX_TRANSPORT_ERRORS = int(os.getenv("TRENDS_MAX_TRANSPORT_ERRORS", 2))  # in a row, before a circuit is renewed
+TOR_SOCKS_HOST = os.getenv("TOR_SOCKS_HOST", "127.0.0.1")
+TOR_SOCKS_PORTS = [int(port) for port in os.getenv("TOR_SOCKS_PORTS", "9050").split(",") if port.strip()]
+
+class TorCircuit:
+    def __init__(self, slot, port, host=TOR_SOCKS_HOST, pacer=None):
+        self.slot = slot
+        self.port = port
+        self.username = f"trends-{slot}-{uuid.uuid4().hex[:12]}"
+        self.proxy = f"socks5h://{self.username}:x@{host}:{port}"
+        self.session = None
+        self.exit_ip = None
+        self.uses = 0
+        self.transport_errors = 0  # in a row; reset by every answered request
+        self.ready_at = 0.0
+        self.pacer = pacer or new_trends_pacer()  # per exit IP: Google rate-limits each address separately
+
+    def __repr__(self):
+        return f"<circuit {self.slot} :{self.port} {self.exit_ip or '?'}>"
+
+def _new_trends_session(proxy):
+    _pandas()
+    from pytrends.request import TrendReq
+    return TrendReq(proxies=[proxy], timeout=(20, 40))  # (connect, read)
+
+class CircuitPool:
+    """
+    Hands out idle circuits to Trends workers. Every circuit paces itself; one whose recent error rate
+    (429s and transport errors) calls for it is retired and a replacement is built in the background, so the other workers keep going.
+    """
+
+    def __init__(self, size=TRENDS_CIRCUITS, ports=None, host=TOR_SOCKS_HOST, session_factory=None,
+                 ip_checker=None, pacer_factory=None, max_build_attempts=3):
+        self.size = max(size, 1)
+        self.ports = ports or TOR_SOCKS_PORTS
+        self.host = host
+        self.session_factory = session_factory or _new_trends_session
+        self.ip_checker = ip_checker if ip_checker is not None else (lambda proxy: get_current_tor_ip(proxy=proxy))
+        self.pacer_factory = pacer_factory or new_trends_pacer
+        self.max_build_attempts = max_build_attempts
+        self.retirements = 0
+        self.renewals = 0
+        self._idle = []
+        self._pacers = []  # every circuit's pacer, retired ones included, for the run's stats
+        self._alive = self.size  # slots that have, or are building, a circuit
+        self._cond = threading.Condition()
+        self._builder = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="tor-circuit")
+        self._closed = False
+        for slot in range(self.size):
+            self._builder.submit(self._build, slot, None)
+
+    def _build(self, slot, retired_ip):
+        port = self.ports[slot % len(self.ports)]
+        for attempt in range(self.max_build_attempts):
+            circuit = TorCircuit(slot, port, self.host, pacer=self.pacer_factory())
+            try:
+                circuit.exit_ip = self.ip_checker(circuit.proxy)
+                if retired_ip and circuit.exit_ip == retired_ip and attempt + 1 < self.max_build_attempts:
+                    print(f"[WARN] Circuit {slot} came back on the retired exit {retired_ip}, building another")
+                    continue
+                circuit.session = self.session_factory(circuit.proxy)
+            except Exception as e:
+                print(f"[WARN] Building circuit {slot} failed ({attempt + 1}/{self.max_build_attempts}): {e}")
+                time.sleep(min(2 ** attempt, 10))
+                continue
+            with self._cond:
+                if self._closed:
+                    return
+                self._idle.append(circuit)
+                self._pacers.append(circuit.pacer)
+                self._cond.notify()
+            print(f"[INFO] Circuit {slot} ready on port {port} (exit {circuit.exit_ip or 'unknown'})")
+            return
+        print(f"[ERROR] Giving up on circuit {slot} after {self.max_build_attempts} attempts.")
+        with self._cond:
+            self._alive -= 1
+            self._cond.notify_all()
+
+    def acquire(self):
+        """Block until an idle circuit has finished its cool-down and return it."""
+        with self._cond:
+            while True:
+                if not self._idle:
+                    if self._alive == 0:
+                        raise RuntimeError("No Tor circuits available.")
+                    self._cond.wait()
+                    continue
+                circuit = min(self._idle, key=lambda c: c.ready_at)
+                wait = circuit.ready_at - time.monotonic()
+                if wait <= 0:
+                    self._idle.remove(circuit)
+                    return circuit
+                self._cond.wait(timeout=wait)
+
+    def release(self, circuit, cooldown=0.0):
+        """Return a healthy circuit; it is handed out again only after `cooldown` seconds."""
+        circuit.uses += 1
+        circuit.ready_at = time.monotonic() + cooldown
+        with self._cond:
+            self._idle.append(circuit)
+            self._cond.notify()
+
+    def retire(self, circuit, reason="429"):
+        """Drop a circuit and build its replacement asynchronously on fresh credentials."""
+        self.retirements += 1
+        circuit.pacer.rotated()
+        print(f"[INFO] Retiring {circuit} ({reason}); renewing in the background")
+        with self._cond:
+            if self._closed:
+                return
+        self.renewals += 1
+        self._builder.submit(self._build, circuit.slot, circuit.exit_ip)
+
+    def pacing_stats(self):
+        with self._cond:
+            pacers = list(self._pacers)
+        return merge_pacing_stats(pacer.stats() for pacer in pacers)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._idle.clear()
+            self._cond.notify_all()
+        self._builder.shutdown(wait=False, cancel_futures=True)
+#---------------------------------------------------------------------------------------------------------------------------
 #---------------------------------------------------------------------------------------------------------------------------
 # Externalized country code loading
 def load_country_codes(filepath="country_codes.json"):
@@ -130,126 +563,724 @@ def load_country_codes(filepath="country_codes.json"):
         print(f"[ERROR] {filepath} not found.")
         return {}
 #---------------------------------------------------------------------------------------------------------------------------
-def get_top_trending_queries(limit=100, max_checks=100):
-    max_retries = 3
-    scores = []
-    queries = [f"{country} {phrase}" for country, phrase_list in country_phrase_map.items() for phrase in phrase_list]
+# Query plan: every "country: phrase" pair is resolved once per run into an immutable record (query string,
+# country, ISO geo code, topic, NewsAPI source IDs) that all stages share. The compiled plan is persisted and
+# keyed on hashes of its inputs, so a run with unchanged phrases, country codes and sources just loads it.
+QUERY_PLAN_PATH = os.path.join(CACHE_DIR, "query_plan.json")
 
-    # Randomize queries
-    random.shuffle(queries)
+QueryPlan = namedtuple("QueryPlan", ["query", "country", "geo", "topic", "source_ids"])
 
-    # Load country codes from external file
-    country_code_map = load_country_codes()
-    
-    # Define the proxies here (for use with both pytrends and requests)
-    proxies = {'http': 'socks5h://127.0.0.1:9050', 'https': 'socks5h://127.0.0.1:9050'}
+def _country_key(name):
+    return re.sub(r"[^a-z0-9]", "", name.lower())
 
-    for idx, query in enumerate(queries[:max_checks]):
-        print(f"[INFO] Checking {idx+1}/{max_checks} → {query}")
+def resolve_country_code(country, country_code_map):
+    """ISO code for a phrases.txt country name, tolerant of case, spacing and punctuation ("Vietnam" → "Viet Nam")."""
+    if country in country_code_map:
+        return country_code_map[country]
+    key = _country_key(country)
+    return next((code for name, code in country_code_map.items() if _country_key(name) == key), "")
 
-        # Extract country from query prefix (assumes first word is country name)
-        matched_country = next((c for c in country_code_map if query.lower().startswith(c.lower())), None)
-        geo_code = country_code_map.get(matched_country, "")
+def _file_digest(path):
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return ""
 
-        
-        retries = 0
-        while retries < max_retries:
-            try:
-                pytrends.build_payload([query], timeframe='now 1-d', geo=geo_code)
-                interest = pytrends.interest_over_time()
-                
-                # Check if interest data exists and has positive values
-                if not interest.empty and interest[query].sum() > 0:
-                    avg_score = interest[query].mean()
-                    scores.append((query, avg_score))
-                    print(f"[INFO] {query} ⟶ {avg_score:.2f} (geo={geo_code})")
+def compile_query_plan(phrases_path="phrases.txt", codes_path="country_codes.json", plan_path=QUERY_PLAN_PATH):
+    """Return the list of QueryPlan records in phrases.txt order, loading the persisted plan when its inputs are unchanged."""
+    sources = get_all_sources()
+    sources_digest = hashlib.sha256(json.dumps(
+        sorted((src.get("id") or "", src.get("country") or "") for src in sources)).encode("utf-8")).hexdigest()
+    key = "|".join([_file_digest(phrases_path), _file_digest(codes_path), sources_digest])
+
+    try:
+        with open(plan_path, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        if stored.get("key") == key:
+            plans = [QueryPlan(q, c, g, t, tuple(ids)) for q, c, g, t, ids in stored["plans"]]
+            print(f"[INFO] Loaded query plan ({len(plans)} queries) from {plan_path}")
+            return plans
+    except (FileNotFoundError, ValueError, KeyError, TypeError):
+        pass
+
+    country_code_map = load_country_codes(codes_path)
+    phrase_map = load_country_phrases(phrases_path)
+    source_ids_by_code = defaultdict(list)
+    for src in sources:
+        source_ids_by_code[(src.get("country") or "").lower()].append(src["id"])
+
+    plans = []
+    for country, phrases in phrase_map.items():
+        geo = resolve_country_code(country, country_code_map)
+        if not geo:
+            print(f"[WARN] No country code for '{country}'; its Trends lookups will be global.")
+        source_ids = tuple(source_ids_by_code.get(geo.lower(), ())) if geo else ()
+        for phrase in phrases:
+            plans.append(QueryPlan(f"{country} {phrase}", country, geo, phrase, source_ids))
+
+    os.makedirs(os.path.dirname(plan_path) or ".", exist_ok=True)
+    tmp_path = plan_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"key": key, "plans": [list(plan) for plan in plans]}, f)
+    os.replace(tmp_path, plan_path)
+    print(f"[INFO] Compiled query plan: {len(plans)} queries across {len(phrase_map)} countries")
+    return plans
+#---------------------------------------------------------------------------------------------------------------------------
+# Persistent trend-score cache, so a rerun (or a run with a partly changed phrases.txt) only asks
+# Google for the (query, geo, timeframe) keys it has not seen within the TTL.
+TREND_CACHE_PATH = os.path.join(CACHE_DIR, "trend_scores.sqlite")
+TREND_CACHE_TTL_HOURS = float(os.getenv("TREND_CACHE_TTL_HOURS", 20))
+
+class TrendScoreCache:
+    """SQLite-backed store of trend scores with a TTL and hit/miss counters. A NULL score means "no trend data"."""
+
+    def __init__(self, path=TREND_CACHE_PATH, ttl_hours=TREND_CACHE_TTL_HOURS):
+        self.path = path
+        self.ttl = ttl_hours * 3600
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS trend_scores (
+                    query TEXT NOT NULL,
+                    geo TEXT NOT NULL,
+                    timeframe TEXT NOT NULL,
+                    score_mode TEXT NOT NULL,
+                    score REAL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (query, geo, timeframe, score_mode)
+                )""")
+        return self._conn
+
+    def get(self, query, geo, timeframe, score_mode="series"):
+        """Return (hit, score). Expired rows count as misses."""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT score, fetched_at FROM trend_scores WHERE query=? AND geo=? AND timeframe=? AND score_mode=?",
+                (query, geo, timeframe, score_mode)).fetchone()
+            if row is None or time.time() - row[1] > self.ttl:
+                self.misses += 1
+                metrics.incr("trend_cache.misses")
+                return False, None
+            self.hits += 1
+            metrics.incr("trend_cache.hits")
+            return True, row[0]
+
+    def put(self, query, geo, timeframe, score_mode, score):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO trend_scores VALUES (?, ?, ?, ?, ?, ?)",
+                         (query, geo, timeframe, score_mode, None if score is None else float(score), time.time()))
+            conn.commit()
+
+    def purge_expired(self):
+        """Delete the rows older than the TTL, which get() would never serve again."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM trend_scores WHERE fetched_at < ?", (time.time() - self.ttl,))
+            conn.commit()
+
+trend_cache = TrendScoreCache()
+#---------------------------------------------------------------------------------------------------------------------------
+# Google Trends accepts up to 5 keywords per payload. One slot of every payload is taken by an anchor
+# keyword shared by all payloads of the same geo, so their scores can be rescaled onto one scale.
+TRENDS_BATCH_SIZE = 5
+TRENDS_ANCHOR = os.getenv("TRENDS_ANCHOR")  # unset → the first query of each country in phrases.txt order
+TRENDS_SCORE_MODE = os.getenv("TRENDS_SCORE_MODE", "anchor")  # "anchor" or "series", see _score_batch
+TRENDS_TIMEFRAME = 'now 1-d'
+# Trends reports whole numbers, so a series that averages below half a point reads as all zeros
+TRENDS_RESOLUTION = 0.5
+
+def _is_rate_limited(error):
+    # Check if 429 error in the exception message or type (adjust as needed)
+    return '429' in str(error) or 'Too Many Requests' in str(error)
+
+def _is_transport_error(error):
+    """No answer from Google at all: a SOCKS/proxy failure, a reset connection or a timeout on the circuit."""
+    import requests
+    if isinstance(error, requests.exceptions.RequestException):  # an OSError too, but an answer may have come
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+    return isinstance(error, OSError)
+
+def _fetch_interest(pool, keywords, geo_code, max_retries=3):
+    """
+    Build a Trends payload for `keywords` on a pooled circuit and return its interest-over-time frame
+    (None on failure). After a 429 or a transport error the circuit backs off, and the payload is retried
+    on whichever circuit is ready first. A circuit is retired once its recent error rate calls for it, or
+    after TRENDS_MAX_TRANSPORT_ERRORS transport errors in a row.
+    """
+    retries = 0
+    while retries < max_retries:
+        circuit = pool.acquire()
+        started = time.monotonic()
+        try:
+            with metrics.span("trends.payload"):
+                circuit.session.build_payload(keywords, timeframe=TRENDS_TIMEFRAME, geo=geo_code)
+                interest = circuit.session.interest_over_time()
+        except Exception as e:
+            if _is_rate_limited(e):
+                retries += 1
+                metrics.incr("trends.retries")
+                circuit.pacer.record(rate_limited=True)
+                if circuit.pacer.should_rotate():
+                    print(f"[WARN] Rate limited on {keywords} via {circuit} "
+                          f"(error rate {circuit.pacer.error_rate():.0%}), renewing it ({retries}/{max_retries})...")
+                    pool.retire(circuit)
                 else:
-                    print(f"[INFO] {query} has no trend data in {geo_code or 'global'}")
-                break # exit retry loop on success
-            
-            except Exception as e:
-                # Check if 429 error in the exception message or type (adjust as needed)
-                if '429' in str(e) or 'Too Many Requests' in str(e):
-                    retries += 1
-                    print(f"[WARN] Rate limited on {query}, rotating IP and retrying ({retries}/{max_retries})...")
-                    rotate_tor_ip()
-                    ip = requests.get('http://httpbin.org/ip', proxies=proxies).json()
-                    print("[DEBUG] Current IP via Tor:", ip)
-                    time.sleep(random.uniform(10, 25))  # wait a bit before retrying
+                    cooldown = circuit.pacer.next_delay()
+                    print(f"[WARN] Rate limited on {keywords} via {circuit}, "
+                          f"backing it off {cooldown:.0f}s ({retries}/{max_retries})...")
+                    pool.release(circuit, cooldown=cooldown)
+                continue
+            if _is_transport_error(e):
+                retries += 1
+                metrics.incr("trends.retries")
+                circuit.transport_errors += 1
+                circuit.pacer.record(transport_error=True)
+                if circuit.transport_errors >= TRENDS_MAX_TRANSPORT_ERRORS or circuit.pacer.should_rotate():
+                    print(f"[WARN] {keywords} failed via {circuit}: {e}; "
+                          f"{circuit.transport_errors} transport errors in a row, renewing it ({retries}/{max_retries})...")
+                    pool.retire(circuit, reason="transport errors")
                 else:
-                    print(f"[WARN] {query} failed: {e}")
-                    break  # some other error, exit retry loop
-        
-        # Random delay
-        time.sleep(random.uniform(10, 25))
-        
-        # Rotate Tor IP every 10 queries
-        if (idx + 1) % 10 == 0:
-            rotate_tor_ip()
-            ip = requests.get('http://httpbin.org/ip', proxies=proxies).json()
-            print("[DEBUG] Current IP via Tor:", ip)
-    
-    sorted_queries = sorted(scores, key=lambda x: x[1], reverse=True)[:limit]
-    return [q for q, _ in sorted_queries]
+                    cooldown = circuit.pacer.next_delay()
+                    print(f"[WARN] {keywords} failed via {circuit}: {e}; "
+                          f"backing it off {cooldown:.0f}s and retrying ({retries}/{max_retries})...")
+                    pool.release(circuit, cooldown=cooldown)
+                continue
+            # Google answered, just not with data (e.g. a rejected keyword): the circuit is fine
+            print(f"[WARN] {keywords} failed: {e}")
+            pool.release(circuit, cooldown=circuit.pacer.next_delay())
+            return None  # give up on this payload
+        # Per-circuit pause: this exit IP rests while the other circuits keep working
+        circuit.transport_errors = 0
+        circuit.pacer.record(latency=time.monotonic() - started)
+        pool.release(circuit, cooldown=circuit.pacer.next_delay())
+        return interest
+    return None
+
+def _build_trend_batches(query_geos, batch_size=TRENDS_BATCH_SIZE, anchor=TRENDS_ANCHOR, anchors=None):
+    """
+    Group (query, geo_code) pairs by geo code (keeping their order) and split every group into payloads
+    of at most `batch_size` keywords, each starting with the group's anchor: `anchors[geo_code]`, else
+    `anchor`, else the first query of the group, so no slot is wasted on a keyword we do not score.
+    Returns a list of (geo_code, anchor, [other queries]) tuples.
+    """
+    groups = {}
+    for query, geo_code in query_geos:
+        groups.setdefault(geo_code, []).append(query)
+
+    batches = []
+    for geo_code, group in groups.items():
+        if batch_size <= 1:
+            # One keyword per payload (unbatched lookups)
+            batches.extend((geo_code, query, []) for query in group)
+            continue
+        group_anchor = (anchors or {}).get(geo_code) or anchor or group[0]
+        rest = [q for q in group if q != group_anchor]
+        step = batch_size - 1
+        chunks = [rest[i:i + step] for i in range(0, len(rest), step)] or [[]]
+        batches.extend((geo_code, group_anchor, chunk) for chunk in chunks)
+    return batches
+
+def _score_batch(interest, anchor, batch_queries, score_mode="anchor"):
+    """
+    Score the queries of one payload.
+
+    "anchor" scores every query as its mean interest relative to the anchor's (the anchor scores 100).
+    Trends normalizes each payload to its own peak, but every payload of a geo holds the same anchor, so
+    these scores are comparable across payloads, and across runs that use the same anchor.
+    "series" divides every series by its own peak: the score a single-keyword payload would have returned,
+    on a per-query scale that says nothing about how two queries compare.
+    A query whose series is all zeros gets no score, as "no trend data", so Trends still filters out
+    queries nobody searches for. When the anchor itself is all zeros, the payload is rescaled as if the anchor averaged TRENDS_RESOLUTION, which makes
+    its scores lower bounds.
+    Returns ({query: score}, anchor_mean).
+    """
+    scores = {}
+    if interest is None or interest.empty or anchor not in interest:
+        return scores, None
+
+    anchor_mean = float(interest[anchor].mean())
+    if score_mode == "anchor" and anchor_mean < TRENDS_RESOLUTION and any(
+            query in interest and interest[query].max() > 0 for query in batch_queries):
+        metrics.incr("trends.anchor_below_resolution")
+        print(f"[WARN] Anchor {anchor!r} is below the resolution of a payload; its scores are lower bounds")
+    factor = 100 / max(anchor_mean, TRENDS_RESOLUTION)
+    for query in batch_queries:
+        if query not in interest:
+            continue
+        series = interest[query]
+        if series.max() <= 0:
+            continue
+        if score_mode == "anchor":
+            scores[query] = float(series.mean()) * factor
+        else:
+            scores[query] = float(series.mean()) * 100 / float(series.max())
+    return scores, anchor_mean
+#---------------------------------------------------------------------------------------------------------------------------
+def get_top_trending_queries(plans=None, limit=100, max_checks=100, batch_size=TRENDS_BATCH_SIZE,
+                             score_mode=TRENDS_SCORE_MODE, use_cache=True, circuits=TRENDS_CIRCUITS, pool=None,
+                             with_scores=False):
+    """
+    Score the plans' queries on Google Trends and return the top `limit` QueryPlan records, best first
+    (as (plan, score) pairs when `with_scores`). Queries without trend data are left out.
+    In "anchor" mode every country is scored on its own anchor's scale (each anchor scores 100), so the
+    order, and a `limit` below the number of scored queries, only mean something within a country. Payloads run in parallel, one worker per Tor circuit of
+    `pool` (a CircuitPool of `circuits` is built when none is given).
+    """
+    scores = []
+    all_plans = list(plans if plans is not None else compile_query_plan())
+
+    # Randomize queries
+    plans = list(all_plans)
+    random.shuffle(plans)
+    plans = plans[:max_checks]
+    plan_of = {plan.query: plan for plan in plans}
+    queries = list(plan_of)
+
+    query_geos = [(plan.query, plan.geo) for plan in plans]
+    geo_of = dict(query_geos)
+
+    # One anchor per geo for every run, so cached scores and fresh ones share a scale; the cache keys
+    # anchor scores by their anchor
+    anchors = {}
+    for plan in all_plans:
+        anchors.setdefault(plan.geo, TRENDS_ANCHOR or plan.query)
+    if batch_size <= 1:
+        score_mode = "series"  # every payload is its own anchor
+    mode_of = lambda geo_code: f"anchor:{anchors[geo_code]}" if score_mode == "anchor" else score_mode
+
+    # Serve what we can from the persistent score cache; only the misses go to Google
+    cache = trend_cache if use_cache else None
+    if cache is not None:
+        cache.purge_expired()  # once per run, so the file only holds scores that can still be served
+        misses = []
+        for query, geo_code in query_geos:
+            hit, score = cache.get(query, geo_code, TRENDS_TIMEFRAME, mode_of(geo_code))
+            if not hit:
+                misses.append((query, geo_code))
+            elif score is not None:
+                scores.append((query, score))
+        print(f"[INFO] Trend cache: {len(queries) - len(misses)} cached, {len(misses)} to fetch")
+        query_geos = misses
+    pending = {query for query, _ in query_geos}
+
+    batches = _build_trend_batches(query_geos, batch_size=batch_size, anchors=anchors)
+    lock = threading.Lock()
+
+    def check(idx, batch):
+        geo_code, anchor, batch_queries = batch
+        keywords = [anchor] + batch_queries
+        print(f"[INFO] Checking payload {idx+1}/{len(batches)} ({len(queries)} queries) → {keywords}")
+
+        interest = _fetch_interest(trends_pool, keywords, geo_code)
+
+        with lock:
+            # The anchor is scored only the first time, and only when it is one of our queries
+            to_score = [q for q in keywords if q in pending]
+            pending.difference_update(to_score)
+        batch_scores, _ = _score_batch(interest, anchor, to_score, score_mode)
+
+        if cache is not None and interest is not None:
+            # Failed payloads are not cached; an empty frame is a valid "no trend data" answer
+            for query in to_score:
+                cache.put(query, geo_of[query], TRENDS_TIMEFRAME, mode_of(geo_of[query]), batch_scores.get(query))
+
+        for query in to_score:
+            if query in batch_scores:
+                with lock:
+                    scores.append((query, batch_scores[query]))
+                print(f"[INFO] {query} ⟶ {batch_scores[query]:.2f} (geo={geo_code})")
+            else:
+                print(f"[INFO] {query} has no trend data in {geo_code or 'global'}")
+
+    if batches:
+        trends_pool = pool or CircuitPool(size=circuits)
+        try:
+            with ThreadPoolExecutor(max_workers=trends_pool.size, thread_name_prefix="trends") as workers:
+                list(workers.map(check, range(len(batches)), batches))
+        finally:
+            print(f"[INFO] Circuits retired: {trends_pool.retirements}, renewed: {trends_pool.renewals}")
+            pacing_stats["trends"] = trends_pool.pacing_stats()
+            print(f"[INFO] Pacing — {format_pacing_stats('Trends', pacing_stats['trends'])}")
+            if pool is None:
+                trends_pool.close()
+
+    if cache is not None:
+        print(f"[INFO] Trend cache stats: {cache.hits} hits, {cache.misses} misses")
+
+    # Ties keep the (shuffled) check order, whichever payload or cache a score came from. Anchor scores of
+    # different countries are on different scales: across countries this order is arbitrary
+    order = {query: i for i, query in enumerate(queries)}
+    sorted_queries = sorted(scores, key=lambda x: (-x[1], order[x[0]]))[:limit]
+    if with_scores:
+        return [(plan_of[q], score) for q, score in sorted_queries]
+    return [plan_of[q] for q, _ in sorted_queries]
 
 #---------------------------------------------------------------------------------------------------------------------------
 BASE_URL = "https://newsapi.org/v2/everything"
 SOURCES_URL = "https://newsapi.org/v2/sources"
 
-# Cache sources per country to avoid repeated API calls
+# NewsAPI client settings. Keep the rate at or below what the NewsAPI plan allows.
+NEWSAPI_WORKERS = int(os.getenv("NEWSAPI_WORKERS", 8))
+NEWSAPI_RATE_PER_SEC = float(os.getenv("NEWSAPI_RATE_PER_SEC", 2))
+NEWSAPI_BURST = int(os.getenv("NEWSAPI_BURST", 5))
+NEWSAPI_MAX_RETRIES = 4
+NEWSAPI_TIMEOUT = (10, 30)  # (connect, read)
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, at most `capacity` saved up for bursts."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+newsapi_bucket = TokenBucket(NEWSAPI_RATE_PER_SEC, NEWSAPI_BURST)
+# The bucket is the plan's hard ceiling; the pacer adds delay below it only while NewsAPI pushes back
+newsapi_pacer = PacingController("newsapi", min_delay=0.0, max_delay=NEWSAPI_MAX_DELAY, step=0.5,
+                                 backoff=2.0, latency_target=5)
+#---------------------------------------------------------------------------------------------------------------------------
+# Persistent HTTP cache under every request made through get_http_session() (NewsAPI and article downloads).
+# Bodies are stored once per content hash; an entry is served from disk while its endpoint's TTL lasts, then
+# revalidated with ETag / Last-Modified; above the size cap the least recently used entries are evicted.
+HTTP_CACHE_DIR = os.path.join(CACHE_DIR, "http")
+HTTP_CACHE_MAX_MB = float(os.getenv("HTTP_CACHE_MAX_MB", 200))
+HTTP_CACHE_RULES = [
+    # (URL pattern, seconds an entry stays fresh; None = never cached). The first match wins.
+    (r"/v2/sources", float(os.getenv("HTTP_CACHE_SOURCES_TTL_HOURS", 24 * 7)) * 3600),
+    (r"/v2/everything", None),  # incremental queries, never asked twice
+    (r"httpbin\.org", None),    # exit-IP checks
+    (r"^https?://", float(os.getenv("HTTP_CACHE_ARTICLE_TTL_HOURS", 72)) * 3600),  # publisher pages
+]
+_UNCACHED_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-encoding", "content-length", "set-cookie"}
+_SECRET_PARAMS = {"apikey"}
+
+def _cache_ttl(url):
+    for pattern, ttl in HTTP_CACHE_RULES:
+        if re.search(pattern, url):
+            return ttl
+    return None
+
+def _cache_key(url):
+    """The URL with sorted query parameters and without credentials, which never reach the disk."""
+    parts = urlsplit(url)
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if key.lower() not in _SECRET_PARAMS)
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, urlencode(query), ""))
+
+class HttpCache:
+    """Disk-backed response store: an SQLite index plus content-addressed body files, with an LRU size cap."""
+
+    def __init__(self, directory=HTTP_CACHE_DIR, max_bytes=HTTP_CACHE_MAX_MB * 2 ** 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+        self.disabled = False
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.join(self.directory, "bodies"), exist_ok=True)
+            path = os.path.join(self.directory, "index.sqlite")
+            try:
+                self._conn = self._open(path)
+            except sqlite3.DatabaseError as e:
+                # The cache is disposable: start over instead of failing the run
+                print(f"[WARN] HTTP cache index unreadable ({e}); starting a new one")
+                os.replace(path, path + ".corrupt")
+                self._conn = self._open(path)
+        return self._conn
+
+    @staticmethod
+    def _open(path):
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                body_hash TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used);
+            CREATE INDEX IF NOT EXISTS idx_responses_body_hash ON responses (body_hash);
+        """)
+        return conn
+
+    def _body_path(self, body_hash):
+        return os.path.join(self.directory, "bodies", body_hash[:2], body_hash)
+
+    def lookup(self, key):
+        """The stored entry for `key` as a dict (with its body), or None."""
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT body_hash, status, headers, etag, last_modified, expires_at "
+                               "FROM responses WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            try:
+                with open(self._body_path(row[0]), "rb") as f:
+                    body = f.read()
+            except FileNotFoundError:
+                with conn:
+                    conn.execute("DELETE FROM responses WHERE key=?", (key,))
+                return None
+            with conn:
+                conn.execute("UPDATE responses SET last_used=? WHERE key=?", (time.time(), key))
+        return {"status": row[1], "headers": json.loads(row[2]), "etag": row[3], "last_modified": row[4],
+                "expires_at": row[5], "body": body}
+
+    def store(self, key, status, headers, body, ttl):
+        body_hash = hashlib.sha256(body).hexdigest()
+        path = self._body_path(body_hash)
+        kept = {name: value for name, value in headers.items() if name.lower() not in _UNCACHED_HEADERS}
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(body)
+                os.replace(tmp_path, path)
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (key, body_hash, status, json.dumps(kept), headers.get("ETag"),
+                              headers.get("Last-Modified"), len(body), now, now + ttl, now))
+            self._evict(conn)
+
+    def refresh(self, key, headers, ttl):
+        """A 304 confirmed the entry: it is fresh for another `ttl` seconds, with any new validators."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("UPDATE responses SET fetched_at=?, expires_at=?, last_used=?, "
+                             "etag=COALESCE(?, etag), last_modified=COALESCE(?, last_modified) WHERE key=?",
+                             (now, now + ttl, now, headers.get("ETag"), headers.get("Last-Modified"), key))
+
+    def size(self):
+        with self._lock:
+            return self._size(self._connect())
+
+    @staticmethod
+    def _size(conn):
+        # Bodies shared by several URLs are stored, and counted, once
+        return conn.execute("SELECT COALESCE(SUM(size), 0) FROM "
+                            "(SELECT body_hash, MAX(size) AS size FROM responses GROUP BY body_hash)").fetchone()[0]
+
+    def _evict(self, conn):
+        total = self._size(conn)
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, body_hash, size in conn.execute("SELECT key, body_hash, size FROM responses "
+                                                 "ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            with conn:
+                conn.execute("DELETE FROM responses WHERE key=?", (key,))
+            evicted += 1
+            if conn.execute("SELECT 1 FROM responses WHERE body_hash=?", (body_hash,)).fetchone() is None:
+                total -= size
+                try:
+                    os.remove(self._body_path(body_hash))
+                except FileNotFoundError:
+                    pass
+        metrics.incr("http_cache.evictions", evicted)
+
+http_cache = HttpCache()
+
+def _caching_adapter_class():
+    import requests
+    import requests.adapters
+    from requests.structures import CaseInsensitiveDict
+    from requests.utils import get_encoding_from_headers
+
+    class CachingAdapter(requests.adapters.HTTPAdapter):
+        """HTTPAdapter that answers GETs from `cache` according to HTTP_CACHE_RULES and fills it from the network."""
+
+        def __init__(self, cache, **kwargs):
+            super().__init__(**kwargs)
+            self.cache = cache
+
+        def _from_cache(self, request, entry):
+            response = requests.models.Response()
+            response.status_code = entry["status"]
+            response.headers = CaseInsensitiveDict(entry["headers"])
+            response._content = entry["body"]
+            response._content_consumed = True
+            response.encoding = get_encoding_from_headers(response.headers)
+            response.url = request.url
+            response.reason = "OK"
+            response.request = request
+            response.connection = self
+            response.from_cache = True
+            return response
+
+        def send(self, request, **kwargs):
+            ttl = _cache_ttl(request.url) if request.method == "GET" and not self.cache.disabled else None
+            if ttl is None:
+                return super().send(request, **kwargs)
+            key = _cache_key(request.url)
+            try:
+                entry = self.cache.lookup(key)
+            except (sqlite3.Error, OSError) as e:
+                print(f"[WARN] HTTP cache disabled for this run: {e}")
+                self.cache.disabled = True
+                return super().send(request, **kwargs)
+
+            if entry is not None and entry["expires_at"] > time.time():
+                metrics.incr("http_cache.hits")
+                metrics.incr("http_cache.bytes_saved", len(entry["body"]))
+                return self._from_cache(request, entry)
+            if entry is not None:
+                if entry["etag"]:
+                    request.headers["If-None-Match"] = entry["etag"]
+                if entry["last_modified"]:
+                    request.headers["If-Modified-Since"] = entry["last_modified"]
+
+            response = super().send(request, **kwargs)
+            try:
+                if entry is not None and response.status_code == 304:
+                    self.cache.refresh(key, response.headers, ttl)
+                    metrics.incr("http_cache.revalidated")
+                    metrics.incr("http_cache.bytes_saved", len(entry["body"]))
+                    response.close()
+                    return self._from_cache(request, entry)
+            except (sqlite3.Error, OSError) as e:
+                print(f"[WARN] HTTP cache disabled for this run: {e}")
+                self.cache.disabled = True
+                return response
+            metrics.incr("http_cache.misses")
+            if response.status_code == 200 and "no-store" not in response.headers.get("Cache-Control", ""):
+                if kwargs.get("stream"):
+                    # The caller reads the body (on its own deadline), then stores it with cache_store()
+                    response.cache_store = lambda: self._store(key, response, ttl)
+                else:
+                    self._store(key, response, ttl)
+            return response
+
+        def _store(self, key, response, ttl):
+            try:
+                self.cache.store(key, response.status_code, response.headers, response.content, ttl)
+            except (sqlite3.Error, OSError) as e:
+                print(f"[WARN] HTTP cache disabled for this run: {e}")
+                self.cache.disabled = True
+
+    return CachingAdapter
+
+_http_session = None
+
+def get_http_session():
+    """
+    One keep-alive session shared by every NewsAPI call and article download (sized for both pools), with
+    the persistent HTTP cache underneath.
+    """
+    global _http_session
+    if _http_session is None:
+        import requests
+        session = requests.Session()
+        adapter = _caching_adapter_class()(http_cache, pool_connections=32,
+                                           pool_maxsize=max(NEWSAPI_WORKERS, DOWNLOAD_WORKERS, 10))
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _http_session = session
+    return _http_session
+
+def _newsapi_get(url, params, max_retries=NEWSAPI_MAX_RETRIES):
+    """Rate-limited, adaptively paced GET against NewsAPI. 429 and 5xx responses back off and are retried."""
+    params = dict(params, apiKey=runtime.config["API_KEY"])
+    floor = 0.0
+    for attempt in range(max_retries + 1):
+        newsapi_bucket.acquire()
+        newsapi_pacer.wait(floor)
+        started = time.monotonic()
+        with metrics.span("newsapi.request"):
+            response = get_http_session().get(url, params=params, timeout=NEWSAPI_TIMEOUT)
+        throttled = response.status_code == 429 or response.status_code >= 500
+        newsapi_pacer.record(latency=time.monotonic() - started, rate_limited=response.status_code == 429,
+                             server_error=response.status_code >= 500)
+        if throttled and attempt < max_retries:
+            metrics.incr("newsapi.retries")
+            # The pacer has just backed off; the retry waits for it, but never less than Retry-After
+            retry_after = response.headers.get("Retry-After", "")
+            floor = float(retry_after) if retry_after.isdigit() else 0.0
+            print(f"[WARN] NewsAPI returned {response.status_code}, retrying after backoff "
+                  f"({max(newsapi_pacer.delay, floor):.1f}s, {attempt + 1}/{max_retries})")
+            continue
+        response.raise_for_status()
+        return response.json()
+
+# Cache the sources catalogue to avoid repeated API calls
 _country_sources_cache = {}
 
 def get_all_sources():
     """Fetch all news sources only once per run and cache in memory."""
     if "_all_sources" not in _country_sources_cache:
-        params = {"apiKey": API_KEY, "language": "en"}
+        params = {"language": "en"}
         try:
-            response = requests.get(SOURCES_URL, params=params)
-            response.raise_for_status()
-            sources = response.json().get("sources", [])
+            sources = _newsapi_get(SOURCES_URL, params).get("sources", [])
             _country_sources_cache["_all_sources"] = sources
         except Exception as e:
             print(f"[WARN] Failed to fetch NewsAPI sources: {e}")
             _country_sources_cache["_all_sources"] = []
     return _country_sources_cache["_all_sources"]
     
-def get_local_source_ids(country):
-    """Return all NewsAPI source IDs for a given country, using ISO code from country_codes.json."""
-    if country in _country_sources_cache:
-        return _country_sources_cache[country]
-
-    # Load country code mapping
-    country_code_map = load_country_codes()   # should return { "Thailand": "th", ... }
-    code = country_code_map.get(country, "").lower()
-    all_sources = get_all_sources()
-
-    # Filter sources matching the ISO code
-    local_sources = [src['id'] for src in all_sources if src.get('country', '').lower() == code]
-    _country_sources_cache[country] = local_sources
-    return local_sources
-
-def extract_country_from_query(query):
-    """Extract the country name from the start of the query by matching against known countries (handles spaces)."""
-    query_lower = query.lower()
-    for country in countries:
-        if query_lower.startswith(country.lower()):
-            return country
-    # fallback: first word
-    return query.split(" ")[0]
-    
-def get_news(query):
-    from_date = (datetime.utcnow() - timedelta(days=15)).strftime("%Y-%m-%d")
-    to_date = datetime.utcnow().strftime("%Y-%m-%d")
+# Incremental fetching: every query keeps a high-water mark (the newest publishedAt already ingested, stored
+# in articles.db), so a run only asks for what is newer and pages newest-first until it reaches the mark.
+NEWSAPI_LOOKBACK_DAYS = 15  # window of a query that has no mark yet
+NEWSAPI_PAGE_SIZE = int(os.getenv("NEWSAPI_PAGE_SIZE", 10))
+NEWSAPI_MAX_PER_QUERY = int(os.getenv("NEWSAPI_MAX_PER_QUERY", 20))  # cap per query and run, across pages
+NEWSAPI_MAX_RESULTS = 100  # developer plans answer 426 past the first 100 results (page × pageSize)
+
+def get_news(plan, since=None, page_size=NEWSAPI_PAGE_SIZE, max_articles=NEWSAPI_MAX_PER_QUERY):
+    """
+    Articles for one planned query, newest first: those published after `since` (a publishedAt mark) or,
+    without a mark, within the last NEWSAPI_LOOKBACK_DAYS days. Pages are followed until the mark is
+    reached, the results run out, `max_articles` is hit or the next page would go past NEWSAPI_MAX_RESULTS.
+    An error on the first page propagates; on a later page the pages already received are returned, so
+    the mark only advances to the newest article actually ingested.
+    """
+    now = datetime.now(timezone.utc)
+    from_date = since[:19] if since else (now - timedelta(days=NEWSAPI_LOOKBACK_DAYS)).strftime("%Y-%m-%d")
+    to_date = now.strftime("%Y-%m-%d")
 
-    country = extract_country_from_query(query)
-    local_sources = get_local_source_ids(country)
+    query, country, local_sources = plan.query, plan.country, plan.source_ids
 
     params = {
         "q": query,
-        "apiKey": API_KEY,
         "sortBy": "publishedAt",
         "language": "en",
-        "pageSize": 2,
+        "pageSize": page_size,
         "from": from_date,
         "to": to_date
     }
@@ -259,50 +1290,1035 @@ def get_news(query):
     else:
         print(f"[INFO] No local sources found for {country}. Falling back to global news.")
 
+    articles = []
+    page = 1
+    while len(articles) < max_articles:
+        params["page"] = page
+        try:
+            data = _newsapi_get(BASE_URL, params)
+        except Exception as e:
+            if page == 1:
+                raise
+            metrics.incr("newsapi.partial")
+            print(f"[WARN] Page {page} of '{query}' failed, keeping the {len(articles)} articles of earlier pages: {e}")
+            break
+        metrics.incr("newsapi.pages")
+        batch = data.get("articles", [])
+        fresh = [a for a in batch if not since or a.get("publishedAt", "") > since]
+        articles.extend(fresh)
+        if len(fresh) < len(batch) or len(batch) < page_size or page * page_size >= data.get("totalResults", 0):
+            break  # reached the mark, or nothing older is left
+        if (page + 1) * page_size > NEWSAPI_MAX_RESULTS:
+            break  # the plan serves no more results for this query
+        page += 1
+    return articles[:max_articles]
+
+def _article_row(article, plan):
+    return (article.get("publishedAt", "")[:10], plan.country, plan.topic, article.get("title", ""), article.get("url", ""))
+
+def _query_articles(plan, since=None):
+    """
+    Fetch one planned query and turn its articles into (publishedAt, country, topic, title, url) tuples.
+    Returns (rows, newest publishedAt seen); a failed query returns ([], None) and keeps its old mark.
+    """
     try:
-        response = requests.get(BASE_URL, params=params)
-        response.raise_for_status()
-        return response.json().get("articles", [])
-    except requests.RequestException as e:
-        print(f"Error: Failed to fetch news for '{query}': {e}")
-        return []
+        articles = get_news(plan, since=since)
+    except Exception as e:
+        print(f"Failed to fetch news for query '{plan.query}': {e}")
+        return [], None
+
+    rows = [_article_row(article, plan) for article in articles]
+    newest = max((article.get("publishedAt", "") for article in articles), default="") or None
+    return rows, newest
 #---------------------------------------------------------------------------------------------------------------------------
-def summarize_article(url):
+# Batched fetching: the phrases of one country share its sources list, so they go out as one boolean query,
+# "(country) AND ((phrase 1) OR (phrase 2) ...)", split to stay under NewsAPI's query-length limit and so that
+# the batch's share of articles (NEWSAPI_MAX_PER_QUERY per phrase) fits in the NEWSAPI_MAX_RESULTS a query can
+# return. The returned articles are attributed back to phrases by matching the phrase words against title and
+# description.
+NEWSAPI_BATCH_QUERIES = os.getenv("NEWSAPI_BATCH_QUERIES", "1") != "0"
+NEWSAPI_MAX_QUERY_LENGTH = 500
+_QUERY_OPERATORS = {"AND", "OR", "NOT"}
+
+QueryBatch = namedtuple("QueryBatch", ["query", "country", "geo", "source_ids", "plans"])
+
+def _query_clause(text):
+    # Words only: parentheses and quotes in a phrase would change the boolean query, and a bare
+    # "and"/"or"/"not" must stay a word rather than become an operator
+    words = [w.lower() if w.upper() in _QUERY_OPERATORS else w for w in re.findall(r"[A-Za-z0-9]+", text)]
+    return "(" + " ".join(words) + ")"
+
+def build_country_batches(plans, max_length=NEWSAPI_MAX_QUERY_LENGTH,
+                          max_plans=max(1, NEWSAPI_MAX_RESULTS // NEWSAPI_MAX_PER_QUERY)):
+    """
+    Group plans by country (and sources), keeping their order, and pack every group's phrases into
+    OR queries of at most `max_length` characters and `max_plans` phrases. Returns a list of QueryBatch records.
+    """
+    groups = {}
+    for plan in plans:
+        groups.setdefault((plan.country, plan.geo, plan.source_ids), []).append(plan)
+
+    def batch_query(country, batch_plans):
+        return _query_clause(country) + " AND (" + " OR ".join(_query_clause(p.topic) for p in batch_plans) + ")"
+
+    batches = []
+    for (country, geo, source_ids), group in groups.items():
+        current = []
+        for plan in group:
+            # A phrase too long for any batch still goes out on its own
+            if current and (len(current) >= max_plans or len(batch_query(country, current + [plan])) > max_length):
+                batches.append(QueryBatch(batch_query(country, current), country, geo, source_ids, tuple(current)))
+                current = []
+            current.append(plan)
+        batches.append(QueryBatch(batch_query(country, current), country, geo, source_ids, tuple(current)))
+    return batches
+
+def _terms(text):
+    return _TOKEN.findall(text.lower())
+
+def _word_forms(word):
+    """`word` and its simple inflections: price → prices, priced, pricing; supply → supplies; tax → taxes."""
+    forms = {word, word + "s", word + "es", word + "ed", word + "ing"}
+    if word.endswith("e"):
+        forms.update((word + "d", word[:-1] + "ing"))
+    if word.endswith("y") and len(word) > 2:
+        forms.update((word[:-1] + "ies", word[:-1] + "ied"))
+    return forms
+
+def _has_word(tokens, term):
+    # Whole words only ("port" is not "portuguese"), in either direction ("prices" in a phrase matches "price")
+    return any(form in tokens for form in _word_forms(term)) or any(term in _word_forms(token) for token in tokens)
+
+def attribute_topics(article, plans):
+    """
+    The plans (phrases) an article of a batched query belongs to: every phrase whose words all occur in
+    its title, description or content snippet (as whole words, allowing plural and -ed/-ing forms). NewsAPI
+    also searches the full text we do not see, so with no full match the phrases sharing most words win,
+    and an article that shares no word with any phrase is attributed to every phrase of the batch.
+    """
+    tokens = set(_terms(" ".join(article.get(key) or "" for key in ("title", "description", "content"))))
+    def coverage(plan):
+        terms = _terms(plan.topic)
+        return sum(_has_word(tokens, term) for term in terms) / max(len(terms), 1)
+    scores = [coverage(plan) for plan in plans]
+    best = max(scores, default=0)
+    if best == 0:
+        metrics.incr("newsapi.unattributed")
+        print(f"[INFO] No phrase of the batch in '{article.get('title', '')}'; filed under all {len(plans)} phrases")
+        return list(plans)
+    return [plan for plan, score in zip(plans, scores) if score == best]
+
+def _query_batch_articles(batch, marks):
+    """
+    Fetch one batched query and split its articles into per-plan rows.
+    Returns {plan query: (rows, newest publishedAt)}, like _query_articles does for a single plan.
+    """
+    plans = batch.plans
+    # Start from the oldest mark of the batch (the full window if any phrase has none); each phrase then
+    # keeps only what is newer than its own mark
+    since = None if any(plan.query not in marks for plan in plans) else min(marks[plan.query] for plan in plans)
+    try:
+        articles = get_news(batch, since=since, page_size=min(NEWSAPI_MAX_RESULTS, NEWSAPI_PAGE_SIZE * len(plans)),
+                            max_articles=min(NEWSAPI_MAX_RESULTS, NEWSAPI_MAX_PER_QUERY * len(plans)))
+    except Exception as e:
+        print(f"Failed to fetch news for query '{batch.query}': {e}")
+        return {plan.query: ([], None) for plan in plans}
+
+    rows = {plan.query: [] for plan in plans}
+    newest = {}
+    for article in articles:
+        published = article.get("publishedAt", "")
+        for plan in attribute_topics(article, plans):
+            if plan.query in marks and published <= marks[plan.query]:
+                continue
+            rows[plan.query].append(_article_row(article, plan))
+            newest[plan.query] = max(newest.get(plan.query, ""), published)
+    return {query: (plan_rows, newest.get(query) or None) for query, plan_rows in rows.items()}
+
+def fetch_news_for_queries(plans, max_workers=NEWSAPI_WORKERS, marks=None, batched=NEWSAPI_BATCH_QUERIES):
+    """
+    Fetch all planned queries concurrently over the shared session, each from its high-water mark in
+    `marks` onwards, one OR-batched request per country when `batched`. Pacing is left to the token bucket
+    and the adaptive pacer; the rows keep the order of `plans`, exactly like fetching them one by one.
+    Returns (rows, {query: newest publishedAt}); the marks are committed once the rows are ingested.
+    """
+    marks = marks or {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        if batched:
+            batches = build_country_batches(plans)
+            by_query = {}
+            for result in pool.map(lambda batch: _query_batch_articles(batch, marks), batches):
+                by_query.update(result)
+            per_query = [by_query[plan.query] for plan in plans]
+            print(f"[INFO] NewsAPI: {len(plans)} queries sent as {len(batches)} batched requests")
+        else:
+            per_query = list(pool.map(lambda plan: _query_articles(plan, marks.get(plan.query)), plans))
+    pacing_stats["newsapi"] = newsapi_pacer.stats()
+    print(f"[INFO] Pacing — {format_pacing_stats('NewsAPI', pacing_stats['newsapi'])}")
+    print(f"[INFO] Incremental fetch: {sum(plan.query in marks for plan in plans)}/{len(plans)} queries "
+          f"resumed from their high-water mark")
+    new_marks = {plan.query: newest for plan, (_, newest) in zip(plans, per_query) if newest}
+    return [row for rows, _ in per_query for row in rows], new_marks
+#---------------------------------------------------------------------------------------------------------------------------
+# Built-in extractive summarizer. All texts of a run are split into sentences that share one TF-IDF
+# sentence × term matrix (CSR-style NumPy arrays), and every sentence is scored in one vectorized pass:
+# similarity to its article's centroid, overlap with the title, and how early it comes. The top sentences
+# of each article, in their original order, form its summary.
+SUMMARY_ENGINE = os.getenv("SUMMARY_ENGINE", "tfidf")  # "newspaper" = per-article newspaper nlp()
+SUMMARY_SENTENCES = 5
+SUMMARY_ENGINE_VERSION = "tfidf-1"  # part of the summary cache key; bump when scoring changes
+SUMMARY_CACHE_PATH = os.path.join(CACHE_DIR, "summaries.sqlite")
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])[\"'”’)\]]*\s+(?=[\"'“‘(\[]?[A-Z0-9])|\s*\n\s*")
+_MIN_SENTENCE_TOKENS = 4
+_STOPWORDS = frozenset("""
+    a about after again all also an and any are as at be because been before being between both but by can
+    could did do does during each for from had has have he her here him his how i if in into is it its just
+    more most no nor not now of on once only or other our out over said says she should so some such than
+    that the their them then there these they this those through to too under until up very was we were
+    what when where which while who will with would you your
+""".split())
+
+def split_sentences(text):
+    """Sentences of `text` with at least _MIN_SENTENCE_TOKENS words (drops bylines, captions, stray lines)."""
+    return [sentence.strip() for sentence in _SENTENCE_BREAK.split(text or "")
+            if len(_TOKEN.findall(sentence.lower())) >= _MIN_SENTENCE_TOKENS]
+
+def summarize_texts(texts, titles=None, max_sentences=SUMMARY_SENTENCES):
+    """
+    Extractive summaries of many texts at once. Returns one summary per text (its top `max_sentences`
+    sentences joined by newlines, like newspaper's), or None for a text without usable sentences.
+    """
+    import numpy as np
+
+    titles = titles or [""] * len(texts)
+    summaries = [None] * len(texts)
+    sentences, sentence_doc, sentence_pos = [], [], []
+    for doc, text in enumerate(texts):
+        # Extracted texts often repeat the headline as their first line
+        headline = " ".join(_TOKEN.findall((titles[doc] or "").lower()))
+        body = [sentence for sentence in split_sentences(text) if " ".join(_TOKEN.findall(sentence.lower())) != headline]
+        for pos, sentence in enumerate(body):
+            sentences.append(sentence)
+            sentence_doc.append(doc)
+            sentence_pos.append(pos)
+    if not sentences:
+        return summaries
+
+    # Sentence × term matrix as (row, col, value) triples with one entry per distinct term of a sentence
+    vocab = {}
+    term_ids, lengths = [], []
+    for sentence in sentences:
+        terms = [vocab.setdefault(t, len(vocab)) for t in _TOKEN.findall(sentence.lower()) if t not in _STOPWORDS]
+        term_ids.extend(terms)
+        lengths.append(len(terms))
+    n_sentences, n_docs, n_terms = len(sentences), len(texts), max(len(vocab), 1)
+    sentence_doc = np.asarray(sentence_doc, dtype=np.int64)
+    sentence_pos = np.asarray(sentence_pos, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    pairs, counts = np.unique(np.repeat(np.arange(n_sentences), lengths) * n_terms
+                              + np.asarray(term_ids, dtype=np.int64), return_counts=True)
+    rows, cols = pairs // n_terms, pairs % n_terms
+
+    # Log-scaled TF × smoothed IDF over every sentence of the run, L2-normalized per sentence
+    idf = np.log((1 + n_sentences) / (1 + np.bincount(cols, minlength=n_terms))) + 1
+    weights = (1 + np.log(counts)) * idf[cols]
+    norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=n_sentences))
+    weights /= norms[rows]
+
+    # Cosine similarity of each sentence to its article's centroid (sum of the article's sentence vectors)
+    doc_terms = sentence_doc[rows] * n_terms + cols
+    centroid_keys, centroid_of = np.unique(doc_terms, return_inverse=True)
+    centroid = np.bincount(centroid_of, weights=weights)
+    centroid_norms = np.sqrt(np.bincount(centroid_keys // n_terms, weights=centroid ** 2, minlength=n_docs))
+    centrality = (np.bincount(rows, weights=weights * centroid[centroid_of], minlength=n_sentences)
+                  / np.maximum(centroid_norms[sentence_doc], 1e-12))
+
+    # Share of the title's terms a sentence contains
+    title_keys, title_sizes = [], np.zeros(n_docs)
+    for doc, title in enumerate(titles):
+        terms = {vocab[t] for t in _TOKEN.findall((title or "").lower()) if t in vocab}
+        title_keys.extend(doc * n_terms + term for term in terms)
+        title_sizes[doc] = len(terms)
+    in_title = np.isin(doc_terms, np.asarray(title_keys, dtype=np.int64))
+    title_overlap = (np.bincount(rows, weights=in_title, minlength=n_sentences)
+                     / np.maximum(title_sizes[sentence_doc], 1))
+
+    lead = 1 / np.sqrt(1 + sentence_pos)
+    short = np.minimum(lengths / 8, 1)  # sentences with few content words are rarely the point
+    scores = (centrality + 0.5 * title_overlap + 0.3 * lead) * short
+
+    # Top `max_sentences` per article: sort by (article, -score), rank within each article, keep, restore order
+    order = np.lexsort((-scores, sentence_doc))
+    ranked_doc = sentence_doc[order]
+    rank = np.arange(n_sentences) - np.searchsorted(ranked_doc, ranked_doc, side="left")
+    chosen = defaultdict(list)
+    for idx in np.sort(order[rank < max_sentences]):
+        chosen[int(sentence_doc[idx])].append(sentences[idx])
+    for doc, picked in chosen.items():
+        summaries[doc] = "\n".join(picked)
+    return summaries
+
+def text_hash(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+class SummaryCache:
+    """SQLite store of summaries keyed by a hash of the article text and the engine version."""
+
+    def __init__(self, path=SUMMARY_CACHE_PATH, engine=SUMMARY_ENGINE_VERSION):
+        self.path = path
+        self.engine = engine
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS summaries (
+                    text_hash TEXT NOT NULL,
+                    engine TEXT NOT NULL,
+                    summary TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (text_hash, engine)
+                )""")
+        return self._conn
+
+    def get_many(self, hashes):
+        """{hash: summary} for the hashes already summarized by this engine."""
+        conn, found = self._connect(), {}
+        hashes = list(set(hashes))
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            found.update(conn.execute(
+                f"SELECT text_hash, summary FROM summaries WHERE engine=? AND text_hash IN ({','.join('?' * len(chunk))})",
+                [self.engine] + chunk).fetchall())
+        return found
+
+    def put_many(self, items):
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?)",
+                             [(h, self.engine, summary, time.time()) for h, summary in items])
+
+summary_cache = SummaryCache()
+
+def summarize_extracted(extracted, cache=summary_cache):
+    """
+    Summaries for (title, text) pairs (None entries stay None). Texts already in the summary cache are
+    skipped; the rest go through summarize_texts in one batch. A text without usable sentences gets its
+    first 500 characters, as newspaper's fallback did.
+    """
+    hashes = [text_hash(item[1]) if item else None for item in extracted]
     try:
-        article = Article(url)
-        article.download()
-        article.parse()
+        cached = cache.get_many([h for h in hashes if h])
+    except sqlite3.Error as e:
+        print(f"[WARN] Summary cache unavailable: {e}")
+        cached = {}
+    todo = {h: item for h, item in zip(hashes, extracted) if h and h not in cached}
+    metrics.incr("summary_cache.hits", sum(1 for h in hashes if h in cached))
+    metrics.incr("summary_cache.misses", len(todo))
+
+    if todo:
+        items = list(todo.items())
+        with metrics.span("summary.batch"):
+            batch = summarize_texts([text for _, (_, text) in items], [title for _, (title, _) in items])
+        fresh = [(h, summary if summary is not None else (text or "")[:500])
+                 for (h, (_, text)), summary in zip(items, batch)]
         try:
-            article.nlp()
-            return article.summary
-        except:
-            return article.text[:500]
+            cache.put_many(fresh)
+        except sqlite3.Error as e:
+            print(f"[WARN] Could not store summaries: {e}")
+        cached.update(fresh)
+    return [cached[h] if h else None for h in hashes]
+#---------------------------------------------------------------------------------------------------------------------------
+# Summarization pool settings
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 16))
+NLP_WORKERS = int(os.getenv("NLP_WORKERS", os.cpu_count() or 2))
+PER_DOMAIN_CONCURRENCY = int(os.getenv("PER_DOMAIN_CONCURRENCY", 2))
+ARTICLE_DEADLINE = float(os.getenv("ARTICLE_DEADLINE", 45))  # seconds per article, download + NLP
+ARTICLE_REQUEST_TIMEOUT = 15
+
+def _summarize_html(url, html):
+    """Parse already-downloaded HTML and summarize it. CPU-bound, so it runs in the process pool."""
+    article = _newspaper().Article(url)
+    article.download(input_html=html)
+    article.parse()
+    try:
+        article.nlp()
+        return article.summary
+    except:
+        return article.text[:500]
+
+def _extract_article(url, html):
+    """Parse already-downloaded HTML into (title, text) for the batch summarizer. Runs in the process pool."""
+    article = _newspaper().Article(url)
+    article.download(input_html=html)
+    article.parse()
+    return article.title, article.text
+
+def _timed(fn, *args):
+    # Spans recorded inside a pool worker never reach the parent, so the duration travels with the result
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+def _read_body(response, deadline_at):
+    """
+    Read a streamed body, giving up once time.monotonic() passes `deadline_at`. The request timeout only
+    bounds each socket read, so a page that trickles in would otherwise hold on far longer.
+    """
+    raw = response.raw
+    read = getattr(raw, "read1", None) or raw.read  # read1 returns what has arrived instead of waiting for a full chunk
+    chunks = []
+    try:
+        while True:
+            if deadline_at is not None and time.monotonic() > deadline_at:
+                raise TimeoutError("download ran past the article deadline")
+            chunk = read(64 * 1024, decode_content=True)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        response.close()
+    response._content = b"".join(chunks)
+    response._content_consumed = True
+
+def _download_article_html(url, timeout=ARTICLE_REQUEST_TIMEOUT, deadline_at=None):
+    """Fetch an article page; with `deadline_at` (a time.monotonic() value) the whole download is bounded by it."""
+    newspaper = _newspaper()
+    config = newspaper.Config()
+    config.request_timeout = timeout
+    # Same request newspaper would make, but over the shared session so pages come from the HTTP cache on reruns
+    kwargs = newspaper.network.get_request_kwargs(timeout, config.browser_user_agent, config.proxies, config.headers)
+    with metrics.span("article.download"):
+        response = get_http_session().get(url, stream=True, **kwargs)
+        if not response._content_consumed:
+            _read_body(response, deadline_at)
+    response.raise_for_status()
+    if hasattr(response, "cache_store"):
+        response.cache_store()
+    return newspaper.network.get_html_2XX_only(url, config, response=response)
+
+def summarize_article(url, deadline_at=None):
+    try:
+        html = _download_article_html(url, deadline_at=deadline_at)
+        with metrics.span("article.nlp"):
+            return _summarize_html(url, html)
     except Exception as e:
+        metrics.incr("article.failures")
         print(f"[WARN] Failed to summarize article: {url} | Reason: {e}")
         return None
+
+def _stop_process_pool(pool):
+    """Shut a process pool down without waiting for what is still running: its workers are terminated."""
+    processes = list((getattr(pool, "_processes", None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+def summarize_articles(urls, download_workers=DOWNLOAD_WORKERS, nlp_workers=NLP_WORKERS,
+                       per_domain=PER_DOMAIN_CONCURRENCY, deadline=ARTICLE_DEADLINE, engine=SUMMARY_ENGINE,
+                       stop_at=None):
+    """
+    Summarize many URLs at once: downloads run on a thread pool (at most `per_domain` at a time per
+    publisher), parsing runs on a process pool, and every article gets `deadline` seconds in total,
+    download and parse included. Articles still running at their deadline are abandoned, and a parse
+    that never returns is killed with the pool's workers rather than waited for.
+    With the "tfidf" engine the parsed texts are then summarized together by summarize_extracted; with
+    "newspaper" each article gets newspaper's nlp() in the process pool.
+    `stop_at` (a time.monotonic() value) bounds the whole batch: articles are dispatched in the order of
+    `urls` until the time left is less than a recent article took, the rest are skipped, and whatever is
+    still running at `stop_at` is abandoned.
+    Returns (summaries in the order of `urls`, number of articles skipped or abandoned at `stop_at`); failed,
+    late or skipped articles yield None like summarize_article.
+    """
+    batched = engine != "newspaper"
+    worker, span = (_extract_article, "article.parse") if batched else (_summarize_html, "article.nlp")
+    domain_slots = defaultdict(lambda: threading.BoundedSemaphore(per_domain))
+    slots_lock = threading.Lock()
+    durations = deque(maxlen=20)  # recent article times, to tell when the next one would overrun stop_at
+    skipped = []
+
+    def expected_duration():
+        with slots_lock:
+            recent = sorted(durations)
+        return recent[len(recent) // 2] if recent else 1.0
+
+    nlp_pool = ProcessPoolExecutor(max_workers=nlp_workers)
+    download_pool = ThreadPoolExecutor(max_workers=download_workers)
+    try:
+        def job(url):
+            # The clock starts when the job is dispatched, so waiting on a busy domain counts too
+            started = time.monotonic()
+            if stop_at is not None and stop_at - started < expected_duration():
+                metrics.incr("article.skipped_deadline")
+                skipped.append(url)
+                return None
+            limit = deadline if stop_at is None else min(deadline, stop_at - started)
+            remaining = lambda: limit - (time.monotonic() - started)
+            try:
+                with slots_lock:
+                    slot = domain_slots[urlparse(url).netloc.lower()]
+                if not slot.acquire(timeout=max(remaining(), 0)):
+                    raise TimeoutError("domain busy past the article deadline")
+                try:
+                    html = _download_article_html(url, timeout=min(ARTICLE_REQUEST_TIMEOUT, max(remaining(), 1)),
+                                                  deadline_at=started + limit)
+                finally:
+                    slot.release()
+                result, seconds = nlp_pool.submit(_timed, worker, url, html).result(timeout=max(remaining(), 0))
+                metrics.record(span, seconds)
+                with slots_lock:
+                    durations.append(time.monotonic() - started)
+                return result
+            except FutureTimeoutError:
+                print(f"[WARN] Failed to summarize article: {url} | Reason: deadline of {limit:.0f}s exceeded")
+            except Exception as e:
+                print(f"[WARN] Failed to summarize article: {url} | Reason: {e}")
+            metrics.incr("article.failures")
+            return None
+
+        futures = [download_pool.submit(job, url) for url in urls]
+        # Every job ends by its own deadline; the wait is bounded too, in case a job is stuck where it can't tell
+        bound = deadline * -(-len(urls) // max(download_workers, 1)) + 5
+        if stop_at is not None:
+            bound = min(bound, max(stop_at - time.monotonic(), 0) + 1)
+        done, _ = wait(futures, timeout=bound)
+        results = [f.result() if f in done else None for f in futures]
+        late = len(futures) - len(done)
+        abandoned = late if stop_at is not None and time.monotonic() >= stop_at else 0
+        if late:
+            metrics.incr("article.skipped_deadline" if abandoned else "article.failures", late)
+            print(f"[WARN] {late} articles were still running at the deadline and were abandoned")
+    finally:
+        download_pool.shutdown(wait=False, cancel_futures=True)
+        _stop_process_pool(nlp_pool)
+    if skipped:
+        print(f"[WARN] Summarize deadline near: {len(skipped)} of {len(urls)} articles were not dispatched")
+    return (summarize_extracted(results) if batched else results), len(skipped) + abandoned
 #---------------------------------------------------------------------------------------------------------------------------
 def send_email(content):
-    
-    recipients = [email.strip() for email in EMAIL_TO.split(",") if email.strip()]
+    import smtplib
+    from email.mime.text import MIMEText
+
+    config = runtime.config
+    recipients = [email.strip() for email in config["EMAIL_TO"].split(",") if email.strip()]
     msg = MIMEText(content, "html", "utf-8")
     msg["Subject"] = "📰 Daily Cement News Summary"
-    msg["From"] = EMAIL_USER
+    msg["From"] = config["EMAIL_USER"]
     msg["To"] = ", ".join(recipients)
 
     try:
-        with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT) as server:
+        with metrics.span("smtp.send"), smtplib.SMTP(config["EMAIL_HOST"], config["EMAIL_PORT"]) as server:
             server.starttls()
-            server.login(EMAIL_USER, EMAIL_PASSWORD)
+            server.login(config["EMAIL_USER"], config["EMAIL_PASSWORD"])
             server.send_message(msg)
         print("[INFO] Email sent successfully.")
+        return True
     except Exception as e:
         print(f"[ERROR] Failed to send email: {e}")
+        return False
+#---------------------------------------------------------------------------------------------------------------------------
+def url_hash(url):
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+class ArticleStore:
+    """
+    Append-only article history in SQLite (WAL mode). Rows are the usual
+    (publishedAt, country, topic, title, url) tuples, unique on a hash of the URL and indexed by date,
+    so dedup is a single index probe and a run only writes its new rows.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, ARTICLE_DB_FILENAME)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS articles (
+                url_hash TEXT NOT NULL,
+                published_at TEXT NOT NULL,
+                country TEXT,
+                topic TEXT,
+                title TEXT,
+                url TEXT NOT NULL,
+                added_at TEXT NOT NULL
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_articles_url_hash ON articles (url_hash);
+            CREATE INDEX IF NOT EXISTS idx_articles_published_at ON articles (published_at);
+            CREATE TABLE IF NOT EXISTS migrations (source TEXT PRIMARY KEY, rows INTEGER, migrated_at TEXT);
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                url_hash TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                fp INTEGER NOT NULL,
+                b0 INTEGER NOT NULL, b1 INTEGER NOT NULL, b2 INTEGER NOT NULL, b3 INTEGER NOT NULL,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (url_hash, kind)
+            );
+            CREATE INDEX IF NOT EXISTS idx_fp_b0 ON fingerprints (kind, b0);
+            CREATE INDEX IF NOT EXISTS idx_fp_b1 ON fingerprints (kind, b1);
+            CREATE INDEX IF NOT EXISTS idx_fp_b2 ON fingerprints (kind, b2);
+            CREATE INDEX IF NOT EXISTS idx_fp_b3 ON fingerprints (kind, b3);
+            CREATE TABLE IF NOT EXISTS fetch_marks (
+                query TEXT PRIMARY KEY,
+                published_at TEXT NOT NULL,
+                previous_published_at TEXT,
+                run_id TEXT,
+                updated_at TEXT NOT NULL
+            );
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(articles)")}
+        if "archived_at" not in columns:
+            # Set once a row has been copied into the columnar quarterly archive
+            self.conn.execute("ALTER TABLE articles ADD COLUMN archived_at TEXT")
+        # Only the rows still to archive (the current and previous quarter, plus any backlog), so the
+        # rollover check and recent-history reads don't walk the whole history every run
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_articles_unarchived ON articles (published_at) "
+                          "WHERE archived_at IS NULL")
+        # Pipeline run that wrote a row, so a resumed stage recognises its own earlier writes
+        for table in ("articles", "fingerprints"):
+            if "run_id" not in {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN run_id TEXT")
+
+    def close(self):
+        # Closing the last connection checkpoints the WAL back into the main file
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def unseen(self, entries):
+        """The entries whose URL is not stored yet (first copy of each URL), without writing anything."""
+        new_entries, returned = [], set()
+        for entry in entries:
+            h = url_hash(entry[4])
+            if h in returned or self.conn.execute("SELECT 1 FROM articles WHERE url_hash=?", (h,)).fetchone():
+                continue
+            new_entries.append(entry)
+            returned.add(h)
+        return new_entries
+
+    def add_new(self, entries, run_id=None):
+        """
+        Insert entries whose URL was never seen before and return exactly those, in order.
+        Rows written earlier by the same `run_id` still count as new, so a resumed run gets the same answer.
+        """
+        added_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        new_entries, returned = [], set()
+        with self.conn:
+            for entry in entries:
+                published_at, country, topic, title, url = entry
+                h = url_hash(url)
+                if h in returned:
+                    continue
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO articles (url_hash, published_at, country, topic, title, url, added_at, run_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (h, published_at, country, topic, title, url, added_at, run_id))
+                if cursor.rowcount or (run_id is not None and self.conn.execute(
+                        "SELECT 1 FROM articles WHERE url_hash=? AND run_id=?", (h, run_id)).fetchone()):
+                    new_entries.append(entry)
+                    returned.add(h)
+        return new_entries
+
+    def unarchived_before(self, cutoff):
+        """Well-formed, not yet archived rows published before `cutoff` ("YYYY-MM-DD"), with their url hashes."""
+        rows = self.conn.execute(
+            "SELECT url_hash, published_at, country, topic, title, url FROM articles "
+            "WHERE archived_at IS NULL AND published_at < ? "
+            "AND published_at GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]' ORDER BY published_at",
+            (cutoff,))
+        return [tuple(row) for row in rows]
+
+    def mark_archived(self, hashes):
+        archived_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        with self.conn:
+            self.conn.executemany("UPDATE articles SET archived_at=? WHERE url_hash=?",
+                                  [(archived_at, h) for h in hashes])
+
+    def fetch_marks(self, run_id=None):
+        """
+        {query: newest publishedAt already ingested}. Marks that `run_id` itself advanced are reported at
+        their previous value, so rerunning a stage of that run fetches the same window again.
+        """
+        marks = {}
+        for query, published_at, previous, mark_run in self.conn.execute(
+                "SELECT query, published_at, previous_published_at, run_id FROM fetch_marks"):
+            mark = previous if run_id and mark_run == run_id else published_at
+            if mark:
+                marks[query] = mark
+        return marks
+
+    def advance_marks(self, marks, run_id=None):
+        """Move the per-query high-water marks forward (never back) to the given publishedAt values."""
+        updated_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        with self.conn:
+            for query, published_at in marks.items():
+                row = self.conn.execute("SELECT published_at, run_id FROM fetch_marks WHERE query=?",
+                                        (query,)).fetchone()
+                if row is None:
+                    self.conn.execute("INSERT INTO fetch_marks VALUES (?, ?, NULL, ?, ?)",
+                                      (query, published_at, run_id, updated_at))
+                elif row[1] == run_id and run_id is not None:
+                    self.conn.execute("UPDATE fetch_marks SET published_at=MAX(published_at, ?), updated_at=? "
+                                      "WHERE query=?", (published_at, updated_at, query))
+                elif published_at > row[0]:
+                    self.conn.execute("UPDATE fetch_marks SET published_at=?, previous_published_at=?, run_id=?, "
+                                      "updated_at=? WHERE query=?", (published_at, row[0], run_id, updated_at, query))
+
+    def add_fingerprints(self, kind, items, run_id=None):
+        """Persist (url, simhash) pairs of the given kind ("title" or "summary")."""
+        created_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints (url_hash, kind, fp, b0, b1, b2, b3, created_at, run_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(url_hash(url), kind, _to_signed64(fp), *_simhash_bands(fp), created_at, run_id) for url, fp in items])
+
+    def similar_fingerprint(self, kind, fp, max_distance, since="", exclude_run=None):
+        """
+        Return True if a stored fingerprint of `kind` created after `since` (and not by `exclude_run`)
+        is within `max_distance` bits of `fp`.
+        """
+        bands = _simhash_bands(fp)
+        for i, band in enumerate(bands):
+            rows = self.conn.execute(
+                f"SELECT fp FROM fingerprints WHERE kind=? AND b{i}=? AND created_at >= ? "
+                f"AND (run_id IS NULL OR run_id != ?)", (kind, band, since, exclude_run or ""))
+            if any(hamming_distance(fp, row[0] & 0xFFFFFFFFFFFFFFFF) <= max_distance for row in rows):
+                return True
+        return False
+
+    def migrate_legacy_pickles(self, cache_dir=CACHE_DIR):
+        """One-time import of current.pkl and the Q*-YYYY.pkl archives. Each file is imported only once."""
+        paths = sorted(glob.glob(os.path.join(cache_dir, "Q[1-4]-[0-9][0-9][0-9][0-9].pkl")))
+        paths.append(os.path.join(cache_dir, CACHE_FILENAME))
+        for path in paths:
+            source = os.path.basename(path)
+            if not os.path.exists(path):
+                continue
+            if self.conn.execute("SELECT 1 FROM migrations WHERE source=?", (source,)).fetchone():
+                continue
+            try:
+                with open(path, "rb") as f, metrics.span("pickle.load"):
+                    entries = pickle.load(f)
+            except (pickle.UnpicklingError, EOFError) as e:
+                print(f"[WARN] Skipping unreadable legacy cache {path}: {e}")
+                continue
+            valid = [tuple(entry) for entry in entries if len(entry) == 5 and entry[4]]
+            added = self.add_new(valid)
+            with self.conn:
+                self.conn.execute("INSERT INTO migrations VALUES (?, ?, ?)",
+                                  (source, len(added), datetime.now(timezone.utc).isoformat(timespec="seconds")))
+            print(f"[INFO] Migrated {len(added)}/{len(entries)} entries from {source} into {os.path.basename(self.path)}")
+
+#---------------------------------------------------------------------------------------------------------------------------
+# Near-duplicate detection. The same wire story often shows up under several URLs or several
+# "country phrase" queries; those are collapsed before we spend download and NLP time on them.
+NEAR_DUP_TITLE_DISTANCE = 3      # max differing SimHash bits for two titles to count as the same story
+NEAR_DUP_SUMMARY_DISTANCE = 3
+NEAR_DUP_WINDOW_DAYS = 30        # how far back the persistent fingerprint index is consulted
+_TITLE_SUFFIX = re.compile(r"\s+[-|–—]\s+[^-|–—]{1,60}$")  # " - Reuters", " | Bangkok Post"
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+def _to_signed64(value):
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def _simhash_bands(fp):
+    # Four 16-bit bands: two fingerprints within 3 bits of each other always share at least one band
+    return [(fp >> (16 * i)) & 0xFFFF for i in range(4)]
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+def simhash(text, shingle=2):
+    """64-bit SimHash over lower-cased word tokens and `shingle`-word shingles."""
+    tokens = _TOKEN.findall(text.lower())
+    features = tokens + [" ".join(tokens[i:i + shingle]) for i in range(len(tokens) - shingle + 1)]
+    if not features:
+        return 0
+    weights = [0] * 64
+    for feature in features:
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+def title_fingerprint(title):
+    # Drop the trailing publisher name so syndicated copies of a headline hash alike
+    return simhash(_TITLE_SUFFIX.sub("", title or ""))
+
+def _cluster(fingerprints, max_distance):
+    """Union-find over band-bucketed candidates. Returns a cluster id (index of its first member) per item."""
+    parent = list(range(len(fingerprints)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    buckets = defaultdict(list)
+    for i, fp in enumerate(fingerprints):
+        for band, value in enumerate(_simhash_bands(fp)):
+            buckets[(band, value)].append(i)
+    for members in buckets.values():
+        for pos, i in enumerate(members):
+            for j in members[:pos]:
+                if hamming_distance(fingerprints[i], fingerprints[j]) <= max_distance:
+                    a, b = find(i), find(j)
+                    if a != b:
+                        parent[max(a, b)] = min(a, b)
+    return [find(i) for i in range(len(fingerprints))]
+
+def _near_dup_since():
+    return (datetime.now(timezone.utc) - timedelta(days=NEAR_DUP_WINDOW_DAYS)).isoformat(timespec="seconds")
+
+def cluster_near_duplicates(entries, max_distance=NEAR_DUP_TITLE_DISTANCE, store=None, run_id=None):
+    """
+    Collapse (publishedAt, country, topic, title, url) entries whose titles are near-duplicates, within this
+    run and against titles sent in recent runs. Returns (representatives, related) where `related` maps a
+    representative's URL to the (country, topic) pairs of the copies folded into it. Nothing is recorded
+    here: the titles are fingerprinted by record_sent_stories once the digest is out.
+    """
+    if not entries:
+        return [], {}
+    own_store = store is None
+    store = store or ArticleStore()
+    try:
+        fps = [title_fingerprint(entry[3]) for entry in entries]
+        since = _near_dup_since()
+        # Stories fingerprinted by an earlier run were sent in its digest
+        seen_before = [store.similar_fingerprint("title", fp, max_distance, since, exclude_run=run_id) for fp in fps]
+        clusters = _cluster(fps, max_distance)
+
+        representatives, related = [], {}
+        rep_of = {}
+        for i, entry in enumerate(entries):
+            root = clusters[i]
+            if root not in rep_of:
+                # First member in fetch order (i.e. highest trend rank) represents the cluster
+                rep_of[root] = None if seen_before[root] else entry
+                if rep_of[root] is not None:
+                    representatives.append(entry)
+                    related[entry[4]] = []
+                continue
+            rep = rep_of[root]
+            if rep is not None and (entry[1], entry[2]) != (rep[1], rep[2]) \
+                    and (entry[1], entry[2]) not in related[rep[4]]:
+                related[rep[4]].append((entry[1], entry[2]))
+
+        print(f"[INFO] Near-duplicate detection: {len(entries)} articles → {len(representatives)} stories")
+        return representatives, related
+    finally:
+        if own_store:
+            store.close()
+
+def merge_summary_duplicates(entries, summaries, related, max_distance=NEAR_DUP_SUMMARY_DISTANCE, store=None,
+                             run_id=None):
+    """
+    Second pass once summaries exist: articles with different headlines but near-identical summaries are
+    merged (the earlier entry is kept), and summaries already sent in recent runs are dropped.
+    Returns the kept (entries, summaries, related). Nothing is recorded here: the summaries are
+    fingerprinted by record_sent_stories once the digest is out.
+    """
+    own_store = store is None
+    store = store or ArticleStore()
+    try:
+        since = _near_dup_since()
+        kept, kept_summaries, kept_fps = [], [], []
+        for entry, summary in zip(entries, summaries):
+            if not summary:
+                kept.append(entry); kept_summaries.append(summary); kept_fps.append(None)
+                continue
+            fp = simhash(summary, shingle=3)
+            match = next((k for k, other in enumerate(kept_fps)
+                          if other is not None and hamming_distance(fp, other) <= max_distance), None)
+            if match is not None:
+                rep = kept[match]
+                extra = [(entry[1], entry[2])] + related.get(entry[4], [])
+                related.setdefault(rep[4], []).extend(
+                    pair for pair in extra if pair != (rep[1], rep[2]) and pair not in related[rep[4]])
+                continue
+            if store.similar_fingerprint("summary", fp, max_distance, since, exclude_run=run_id):
+                print(f"[INFO] Dropping already-sent story: {entry[3]}")
+                continue
+            kept.append(entry); kept_summaries.append(summary); kept_fps.append(fp)
+        return kept, kept_summaries, related
+    finally:
+        if own_store:
+            store.close()
+
+def record_sent_stories(sent, candidates, max_distance=NEAR_DUP_TITLE_DISTANCE, store=None, run_id=None,
+                        summaries=None):
+    """
+    Fingerprint the titles of the stories a digest sent, and of the candidates clustered with them, so
+    later runs drop their copies; `summaries`, parallel to `sent`, are fingerprinted for
+    merge_summary_duplicates. Stories left out of the digest (over budget, or past the deadline)
+    stay eligible. Returns the number of titles recorded.
+    """
+    if not sent:
+        return 0
+    sent_urls = {entry[4] for entry in sent}
+    entries = list(sent) + [entry for entry in candidates if entry[4] not in sent_urls]
+    fps = [title_fingerprint(entry[3]) for entry in entries]
+    clusters = _cluster(fps, max_distance)
+    sent_roots = {clusters[i] for i in range(len(sent))}
+    items = [(entry[4], fp) for i, (entry, fp) in enumerate(zip(entries, fps)) if clusters[i] in sent_roots]
+    own_store = store is None
+    store = store or ArticleStore()
+    try:
+        store.add_fingerprints("title", items, run_id=run_id)
+        if summaries:
+            store.add_fingerprints("summary", [(entry[4], simhash(summary, shingle=3))
+                                               for entry, summary in zip(sent, summaries) if summary],
+                                   run_id=run_id)
+    finally:
+        if own_store:
+            store.close()
+    return len(items)
 #---------------------------------------------------------------------------------------------------------------------------
-def update_and_filter_news_cache(new_articles):
+ARCHIVE_COLUMNS = ["published_at", "country", "topic", "title", "url"]
+
+def _archive_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("published_at", pa.date32()),
+        ("country", pa.string()),
+        ("topic", pa.string()),
+        ("title", pa.string()),
+        ("url", pa.string()),
+    ])
+
+def _archive_threshold(now=None):
+    """First day of the previous quarter: the current and previous quarters stay out of the archive."""
+    now = now or datetime.now()
+    current_quarter = get_quarter(now)
+    if current_quarter == 1:
+        year, quarter = now.year - 1, 4
+    else:
+        year, quarter = now.year, current_quarter - 1
+    return f"{year}-{3 * (quarter - 1) + 1:02d}-01"
+
+def archive_closed_quarters(store, archive_dir=None, now=None):
+    """
+    Copy rows of closed quarters into the columnar archive. Every rollover writes one new Parquet segment
+    per quarter (sorted by country and date so row-group statistics prune well); existing segments are
+    never rewritten. Returns the number of rows archived.
+    """
+    archive_dir = archive_dir or os.path.join(CACHE_DIR, ARCHIVE_DIRNAME)
+    rows = store.unarchived_before(_archive_threshold(now))
+    if not rows:
+        return 0
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    quarters = {}
+    for row in rows:
+        date_obj = datetime.strptime(row[1], "%Y-%m-%d")
+        quarters.setdefault((date_obj.year, get_quarter(date_obj)), []).append(row)
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    for (year, quarter), entries in sorted(quarters.items()):
+        entries.sort(key=lambda r: (r[2] or "", r[1]))
+        table = pa.table({
+            "published_at": pa.array([datetime.strptime(r[1], "%Y-%m-%d").date() for r in entries], pa.date32()),
+            "country": [r[2] for r in entries],
+            "topic": [r[3] for r in entries],
+            "title": [r[4] for r in entries],
+            "url": [r[5] for r in entries],
+        }, schema=_archive_schema())
+        segment_dir = os.path.join(archive_dir, f"year={year}", f"quarter={quarter}")
+        os.makedirs(segment_dir, exist_ok=True)
+        segment_path = os.path.join(segment_dir, f"part-{stamp}-{uuid.uuid4().hex[:8]}.parquet")
+        pq.write_table(table, segment_path, row_group_size=10000)
+        # Mark per segment, so a failure part-way only repeats the quarters that were not written
+        store.mark_archived([r[0] for r in entries])
+        print(f"[INFO] Archived {len(entries)} entries to {segment_path}")
+    return len(rows)
+
+def _to_date(value):
+    if value is None or isinstance(value, datetime):
+        return value.date() if value else None
+    if isinstance(value, str):
+        return datetime.strptime(value[:10], "%Y-%m-%d").date()
+    return value
+
+def query_archive(countries=None, start=None, end=None, topics=None, columns=None,
+                  include_recent=True, archive_dir=None):
+    """
+    Read history from the quarterly archive as a DataFrame, filtered by country list, topic list and an
+    inclusive publishedAt range (dates or "YYYY-MM-DD" strings). Filters are pushed down to the Parquet
+    scan, so only matching partitions and row groups are read (memory-mapped). With include_recent, rows
+    still in the live article store are added as well.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+    pd = _pandas()
+
+    archive_dir = archive_dir or os.path.join(CACHE_DIR, ARCHIVE_DIRNAME)
+    start, end = _to_date(start), _to_date(end)
+    columns = columns or ARCHIVE_COLUMNS
+
+    expr = None
+    def _and(e):
+        return e if expr is None else expr & e
+    if start is not None:
+        expr = _and((ds.field("year") >= start.year) & (ds.field("published_at") >= pa.scalar(start, pa.date32())))
+    if end is not None:
+        expr = _and((ds.field("year") <= end.year) & (ds.field("published_at") <= pa.scalar(end, pa.date32())))
+    if countries:
+        expr = _and(ds.field("country").isin(list(countries)))
+    if topics:
+        expr = _and(ds.field("topic").isin(list(topics)))
+
+    frames = []
+    if os.path.isdir(archive_dir):
+        dataset = ds.dataset(archive_dir, format="parquet", partitioning="hive",
+                             filesystem=pafs.LocalFileSystem(use_mmap=True))
+        frames.append(dataset.to_table(columns=list(columns), filter=expr).to_pandas())
+
+    if include_recent and os.path.exists(os.path.join(CACHE_DIR, ARTICLE_DB_FILENAME)):
+        with ArticleStore() as store:
+            clauses, params = ["archived_at IS NULL",
+                               "published_at GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'"], []
+            if start is not None:
+                clauses.append("published_at >= ?"); params.append(start.isoformat())
+            if end is not None:
+                clauses.append("published_at <= ?"); params.append(end.isoformat())
+            for field, values in (("country", countries), ("topic", topics)):
+                if values:
+                    clauses.append(f"{field} IN ({','.join('?' * len(values))})"); params.extend(values)
+            recent = pd.read_sql_query(
+                "SELECT published_at, country, topic, title, url FROM articles WHERE " + " AND ".join(clauses),
+                store.conn, params=params)
+        recent["published_at"] = pd.to_datetime(recent["published_at"]).dt.date
+        frames.append(recent[list(columns)])
+
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=list(columns))
+    return pd.concat(frames, ignore_index=True)
+#---------------------------------------------------------------------------------------------------------------------------
+def load_fetch_marks(run_id=None):
+    """The per-query high-water marks from articles.db ({} when it cannot be read: fetch the full window)."""
+    try:
+        with ArticleStore() as store:
+            return store.fetch_marks(run_id)
+    except sqlite3.DatabaseError as e:
+        print(f"[WARN] Could not read the fetch high-water marks: {e}")
+        return {}
+
+def update_and_filter_news_cache(new_articles, run_id=None, marks=None):
 
-    CACHE_DIR = "news_cache"
     os.makedirs(CACHE_DIR, exist_ok=True) # Ensures the directory exists
-    cache_path = os.path.join(CACHE_DIR, CACHE_FILENAME)
     
     try:
         os.chmod(CACHE_DIR, 0o777)  # Full rwx permissions for all users (use with caution)
@@ -313,149 +2329,339 @@ def update_and_filter_news_cache(new_articles):
     print(f"Cache directory absolute path: {os.path.abspath(CACHE_DIR)}")
     print(f"Cache directory exists: {os.path.exists(CACHE_DIR)}")
     print(f"Cache directory writable: {os.access(CACHE_DIR, os.W_OK)}")
-    
-    print(f"[Debug] Saving cache to: {cache_path}")
-    
-    # Load existing cache
-    if os.path.exists(cache_path):
-        try:
-            with open(cache_path, "rb") as f:
-                cache = pickle.load(f)
-        except (pickle.UnpicklingError, EOFError, FileNotFoundError):
-            corrupt_path = cache_path + ".corrupt"
-            shutil.move(cache_path, corrupt_path)
-            print(f"[Warning] Corrupted cache moved to: {corrupt_path}")
-            cache = []
-    else:
-        cache = []
 
-    now = datetime.now()
-    current_year = now.year
-    current_quarter = get_quarter(now)
+    try:
+        store = ArticleStore()
+    except sqlite3.DatabaseError:
+        db_path = os.path.join(CACHE_DIR, ARTICLE_DB_FILENAME)
+        corrupt_path = db_path + ".corrupt"
+        shutil.move(db_path, corrupt_path)
+        print(f"[Warning] Corrupted cache moved to: {corrupt_path}")
+        store = ArticleStore()
 
-    # Separate entries by quarter-year
-    quarters = {}  # key: (year, quarter), value: list of entries
-    for entry in cache:
-        
-        date_str = entry[0]  # e.g. "2025-05-22"
+    with store:
+        print(f"[Debug] Saving cache to: {store.path}")
+        store.migrate_legacy_pickles()
+
+        # Dedup against the full history; only the new rows are written
+        filtered_articles = store.add_new(new_articles, run_id=run_id)
+        print(f"Cache saved successfully ({len(filtered_articles)} new).")
+        # Only now that the rows are stored may the next run skip everything up to these marks
+        if marks:
+            store.advance_marks(marks, run_id=run_id)
+
+        # Quarter rollover: closed quarters go to the columnar archive. Rows stay in the store for dedup,
+        # and a failed rollover is simply retried by the next run.
         try:
-            date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-        except ValueError:
-            continue  # Skip malformed entries
-        q = get_quarter(date_obj)
-        key = (date_obj.year, q)
-        quarters.setdefault(key, []).append(entry)
- 
-    # Determine which quarters to archive
-    def quarter_less(a, b):
-        if a[0] < b[0]:
-            return True
-        elif a[0] == b[0]:
-            return a[1] < b[1]
-        return False
+            archive_closed_quarters(store)
+        except Exception as e:
+            print(f"[WARN] Quarterly archive rollover failed: {e}")
 
-    if current_quarter == 1:
-        threshold = (current_year - 1, 4)
-    else:
-        threshold = (current_year, current_quarter - 1)
-
-    # Archive quarters older than threshold
-    to_keep = []
-    for q_key, entries in quarters.items():
-        if quarter_less(q_key, threshold):
-            # Archive these entries
-            archive_year, archive_quarter = q_key
-            archive_file = f"Q{archive_quarter}-{archive_year}.pkl"
-            archive_path = os.path.join(CACHE_DIR, archive_file)
-            try:
-                if os.path.exists(archive_path):
-                    with open(archive_path, "rb") as af:
-                        archive_data = pickle.load(af)
-                else:
-                    archive_data = []
-            except (pickle.UnpicklingError, EOFError):
-                archive_data = []
-            archive_data.extend(entries)
-            with open(archive_path, "wb") as af:
-                pickle.dump(archive_data, af)
-        else:
-            # Keep these entries in cache
-            to_keep.extend(entries)
+    return filtered_articles
 
-    cache = to_keep
+#---------------------------------------------------------------------------------------------------------------------------
+# Summarization scheduler. Candidate stories get one priority score (trend score of their query, recency,
+# source locality), the per-run budget is dealt out to countries round-robin (a country that runs out of
+# stories leaves its turns to the others), and the summarize stage stops dispatching downloads once its
+# wall-clock deadline is near, so the digest still goes out on time.
+MAX_SUMMARIES_PER_RUN = int(os.getenv("MAX_SUMMARIES_PER_RUN", 50))
+SUMMARIZE_DEADLINE = float(os.getenv("SUMMARIZE_DEADLINE", 600))  # seconds for the whole summarize stage
+PRIORITY_WEIGHTS = {"trend": 0.5, "recency": 0.3, "local": 0.2}
+RECENCY_HALF_LIFE_DAYS = 2
 
-    recent_urls = set(entry[4] for entry in cache[-MAX_CACHE_SIZE:])
-    filtered_articles = [entry for entry in new_articles if entry[4] not in recent_urls]
-    cache.extend(filtered_articles)
-    
-    cache_path = os.path.join(CACHE_DIR, CACHE_FILENAME)
-    print(f"Saving cache to: {cache_path}")
+def _host(url):
+    host = urlparse(url).netloc.lower().split(":")[0]
+    return host[4:] if host.startswith("www.") else host
 
-    with open(cache_path, "wb") as f:
-        pickle.dump(cache, f)
-    print("Cache saved successfully.")
+def local_source_domains(geos):
+    """Hosts of each country's own NewsAPI sources, as {geo: [host, ...]} for the given geo codes."""
+    domains = defaultdict(set)
+    wanted = {geo.lower() for geo in geos if geo}
+    for src in get_all_sources():
+        geo = (src.get("country") or "").lower()
+        if geo in wanted and src.get("url"):
+            domains[geo].add(_host(src["url"]))
+    return {geo: sorted(hosts) for geo, hosts in domains.items()}
 
-    return filtered_articles
+def _locality(url, plan, local_domains):
+    """1 for an article from one of its country's own NewsAPI sources, 0.5 for a site on its ccTLD, else 0."""
+    if plan is None or not plan.geo:
+        return 0.0
+    host = _host(url)
+    if any(host == domain or host.endswith("." + domain) for domain in local_domains.get(plan.geo.lower(), ())):
+        return 1.0
+    return 0.5 if host.endswith("." + plan.geo.lower()) else 0.0
+
+def _day_number(date):
+    try:
+        return datetime.strptime(date[:10], "%Y-%m-%d").toordinal()
+    except (TypeError, ValueError):
+        return None
+
+def priority_scores(entries, trend_scores, plans, today=None, local_domains=None, weights=PRIORITY_WEIGHTS,
+                    half_life_days=RECENCY_HALF_LIFE_DAYS):
+    """
+    Priority of every (publishedAt, country, topic, title, url) entry, as a NumPy array: a weighted sum of
+    its query's trend score (scaled to 0..1 by the run's best), recency (halving every `half_life_days`)
+    and the locality of its publisher (`local_domains` as returned by local_source_domains).
+    """
+    import numpy as np
+
+    plan_of = {(plan.country, plan.topic): plan for plan in plans}
+    entry_plans = [plan_of.get((entry[1], entry[2])) for entry in entries]
+    trend = np.array([trend_scores.get(plan.query, 0.0) if plan else 0.0 for plan in entry_plans], dtype=float)
+    trend = np.nan_to_num(trend) / max(np.nan_to_num(trend).max(initial=0.0), 1e-9)
+
+    days = np.array([_day_number(entry[0]) or -1 for entry in entries], dtype=float)
+    today = (today or datetime.now(timezone.utc).date()).toordinal()
+    recency = np.where(days >= 0, 0.5 ** (np.clip(today - days, 0, None) / half_life_days), 0.0)
+
+    local = np.array([_locality(entry[4], plan, local_domains or {}) for entry, plan in zip(entries, entry_plans)],
+                     dtype=float)
+    return weights["trend"] * trend + weights["recency"] * recency + weights["local"] * local
+
+def schedule_summaries(entries, trend_scores, plans, budget=MAX_SUMMARIES_PER_RUN, today=None, local_domains=None):
+    """
+    Choose up to `budget` entries fairly across countries and return them in dispatch order: every
+    country's best story (best first), then every country's second best, and so on. A deadline that cuts
+    the run short therefore costs each country its lowest-priority stories first.
+    """
+    import numpy as np
+
+    if not entries or budget <= 0:
+        return []
+    scores = priority_scores(entries, trend_scores, plans, today=today, local_domains=local_domains)
+    _, country = np.unique([entry[1] or "" for entry in entries], return_inverse=True)
+    # Rank of each entry within its country, best first
+    by_country = np.lexsort((-scores, country))
+    grouped = country[by_country]
+    rank = np.empty(len(entries), dtype=np.int64)
+    rank[by_country] = np.arange(len(entries)) - np.searchsorted(grouped, grouped, side="left")
+    chosen = np.lexsort((-scores, rank))[:budget]
+    return [entries[i] for i in chosen]
 
 #---------------------------------------------------------------------------------------------------------------------------
-MAX_SUMMARIES_PER_RUN = 50
+# Staged pipeline. Every stage writes a versioned JSON checkpoint under news_cache/checkpoints/<run_id>/,
+# so a failed run can be resumed at its first incomplete stage without redoing finished network work.
+CHECKPOINT_DIR = os.path.join(CACHE_DIR, "checkpoints")
+SHARD_DIR = os.path.join(CACHE_DIR, "shards")  # shards/<run_id>/shard-I-of-N.json (+ the shard's own checkpoints)
+CHECKPOINT_VERSION = 1
+RESUME_MAX_AGE_HOURS = float(os.getenv("RESUME_MAX_AGE_HOURS", 20))  # older unfinished runs start over
+KEEP_CHECKPOINT_RUNS = 3
+STAGES = ["trends", "fetch", "dedup", "summarize", "digest"]
 
-def main():
-    now = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    raw_articles = []
+def _run_dir(run_id, shard=None):
+    # A shard keeps its checkpoints apart, so `run --resume` never mistakes a shard for a whole run
+    if shard is not None:
+        return os.path.join(SHARD_DIR, run_id, shard_tag(shard))
+    return os.path.join(CHECKPOINT_DIR, run_id)
 
-    # Step 1: Get top queries
-    top_queries = get_top_trending_queries(limit=100)
-    print(f"DEBUG: Top trending queries fetched: {len(top_queries)}")
-    print(top_queries[:10])  # print first 10 for quick check
+def _checkpoint_path(run_id, stage, shard=None):
+    return os.path.join(_run_dir(run_id, shard), f"{stage}.json")
 
-    # Step 2: Fetch news articles for each query
-    for query in top_queries:
-        try:
-            articles = get_news(query)
-        except Exception as e:
-            print(f"Failed to fetch news for query '{query}': {e}")
-            articles = []
+def save_checkpoint(run_id, stage, data, shard=None):
+    path = _checkpoint_path(run_id, stage, shard)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    payload = {"version": CHECKPOINT_VERSION, "stage": stage, "run_id": run_id,
+               "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"), "data": data}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+    os.replace(tmp_path, path)  # a crash mid-write never leaves a half checkpoint behind
 
-        matched_country = next((c for c in countries if c.lower() in query.lower()), "Unknown")
-        topic = query.replace(matched_country, '').strip()
+def load_checkpoint(run_id, stage, shard=None):
+    """Return the stage's data, or None if it is missing, unreadable or from another checkpoint version."""
+    try:
+        with open(_checkpoint_path(run_id, stage, shard), "r", encoding="utf-8") as f:
+            payload = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if payload.get("version") != CHECKPOINT_VERSION:
+        print(f"[WARN] Ignoring {stage} checkpoint of run {run_id}: version {payload.get('version')}")
+        return None
+    return payload["data"]
+
+def _run_ids():
+    if not os.path.isdir(CHECKPOINT_DIR):
+        return []
+    return sorted(d for d in os.listdir(CHECKPOINT_DIR) if os.path.isdir(os.path.join(CHECKPOINT_DIR, d)))
+
+RUN_ID_FORMAT = "%Y%m%dT%H%M%SZ"  # run ids are UTC start times; they sort, and date, the runs
+
+def parse_run_id(value):
+    """A run id given on the command line, which must be a YYYYMMDDTHHMMSSZ timestamp."""
+    datetime.strptime(value, RUN_ID_FORMAT)
+    return value
+
+def _run_age_hours(run_id):
+    started = datetime.strptime(run_id, RUN_ID_FORMAT).replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - started).total_seconds() / 3600
+
+def prune_checkpoints(keep=KEEP_CHECKPOINT_RUNS):
+    for run_id in _run_ids()[:-keep]:
+        shutil.rmtree(os.path.join(CHECKPOINT_DIR, run_id), ignore_errors=True)
+    if os.path.isdir(SHARD_DIR):
+        for run_id in sorted(os.listdir(SHARD_DIR))[:-keep]:
+            shutil.rmtree(os.path.join(SHARD_DIR, run_id), ignore_errors=True)
+    # Metrics files are committed with the checkpoints, so they age out with them
+    if os.path.isdir(METRICS_DIR):
+        for name in sorted(name for name in os.listdir(METRICS_DIR) if name.endswith(".jsonl"))[:-keep]:
+            os.remove(os.path.join(METRICS_DIR, name))
+
+def _as_plan(values):
+    query, country, geo, topic, source_ids = values
+    return QueryPlan(query, country, geo, topic, tuple(source_ids))
+
+def _as_entries(rows):
+    return [tuple(row) for row in rows]
+
+def _as_related(data):
+    return {url: [tuple(pair) for pair in pairs] for url, pairs in data.items()}
+#---------------------------------------------------------------------------------------------------------------------------
+# Sharded runs. `run --shard I/N` takes the countries assigned to shard I (of N) through trends, fetch, dedup
+# and summarize, reading but never writing the article store, and leaves its results in one JSON artifact.
+# `reduce` merges a run's artifacts, dedups them against the article store and across shards, and sends
+# one digest. Shards can run as separate processes or CI jobs, as long as they share the run id.
+Shard = namedtuple("Shard", ["index", "count"])  # 1-based index
+SHARD_ARTIFACT_VERSION = 1
+
+def parse_shard(value):
+    """"I/N" → Shard(I, N), with 1 <= I <= N."""
+    index, _, count = value.partition("/")
+    shard = Shard(int(index), int(count))
+    if not 1 <= shard.index <= shard.count:
+        raise ValueError(f"shard {value} is not of the form I/N with 1 <= I <= N")
+    return shard
+
+def shard_tag(shard):
+    return f"shard-{shard.index}-of-{shard.count}"
 
-        for article in articles:
-            publishedAt = article.get("publishedAt", "")[:10]
-            title = article.get("title", "")
-            url = article.get("url", "")
-            raw_articles.append((publishedAt, matched_country, topic, title, url))
+def default_shard_run_id():
+    # Every shard started on the same UTC day agrees on it without talking to the others
+    return datetime.now(timezone.utc).strftime("%Y%m%dT000000Z")
 
-        time.sleep(random.uniform(1, 3))
-    total_raw = len(raw_articles)
+def assign_shards(plans, count):
+    """
+    Deterministic country → shard index (1-based): countries with the most queries go first, each to the
+    least loaded shard. Every shard computes the same split from the same phrases.txt.
+    """
+    sizes = defaultdict(int)
+    for plan in plans:
+        sizes[plan.country] += 1
+    loads = [0] * count
+    assignment = {}
+    for country in sorted(sizes, key=lambda c: (-sizes[c], c)):
+        target = min(range(count), key=lambda i: (loads[i], i))
+        assignment[country] = target + 1
+        loads[target] += sizes[country]
+    return assignment
 
-    # Step 3: Filter and update cache
+def shard_plans(plans, shard):
+    """The plans of the countries assigned to `shard`, and those countries."""
+    assignment = assign_shards(plans, shard.count)
+    countries = sorted(country for country, index in assignment.items() if index == shard.index)
+    return [plan for plan in plans if assignment[plan.country] == shard.index], countries
+#---------------------------------------------------------------------------------------------------------------------------
+def stage_trends(run_id, state):
+    # Resolve every country/phrase pair once for the whole run, then rank them on Google Trends
+    plans = compile_query_plan()
+    shard, extra = state.get("shard"), {}
+    if shard:
+        total = len({plan.country for plan in plans})
+        plans, countries = shard_plans(plans, shard)
+        print(f"[INFO] Shard {shard.index}/{shard.count}: {len(countries)} of {total} countries, "
+              f"{len(plans)} queries ({', '.join(countries)})")
+        extra = {"countries": countries, "total_countries": total}
+    scored = get_top_trending_queries(plans, limit=100, with_scores=True)
+    top_queries = [plan for plan, _ in scored]
+    print(f"DEBUG: Top trending queries fetched: {len(top_queries)}")
+    print([plan.query for plan in top_queries[:10]])  # print first 10 for quick check
+    return {"top_queries": [list(plan) for plan in top_queries],
+            "scores": {plan.query: float(score) for plan, score in scored}, "pacing": pacing_stats.get("trends"),
+            "local_domains": local_source_domains({plan.geo for plan in top_queries}), **extra}
+
+def stage_fetch(run_id, state):
+    top_queries = [_as_plan(values) for values in state["trends"]["top_queries"]]
+    raw_articles, marks = fetch_news_for_queries(top_queries, marks=load_fetch_marks(run_id))
+    return {"raw_articles": raw_articles, "marks": marks, "pacing": pacing_stats.get("newsapi")}
+
+def stage_dedup(run_id, state):
+    raw_articles = _as_entries(state["fetch"]["raw_articles"])
+    shard = state.get("shard")
     try:
-        filtered_articles = update_and_filter_news_cache(raw_articles)
+        if shard:
+            # Only read the store here; the reduce step stores the merged rows and advances the marks
+            with ArticleStore() as store:
+                filtered_articles = store.unseen(raw_articles)
+        else:
+            filtered_articles = update_and_filter_news_cache(raw_articles, run_id=run_id,
+                                                             marks=state["fetch"].get("marks"))
         filter_failed = False
     except Exception as e:
         print(f"Failed to update and filter news cache: {e}")
         filtered_articles = raw_articles
         filter_failed = True
 
-    total_filtered = len(filtered_articles)
-    summaries_done = 0
-    country_articles = {country: [] for country in countries}
+    # Collapse syndicated / multiply-matched copies of a story so it is downloaded and summarized once
+    try:
+        stories, related = cluster_near_duplicates(filtered_articles, run_id=run_id)
+    except Exception as e:
+        print(f"[WARN] Near-duplicate detection failed: {e}")
+        stories, related = filtered_articles, {}
+    return {"filtered_articles": filtered_articles, "filter_failed": filter_failed,
+            "stories": stories, "related": related}
 
-    for article in filtered_articles:
-        if summaries_done >= MAX_SUMMARIES_PER_RUN:
-            break
-        date, country, topic, title, url = article
-        try:
-            summary = summarize_article(url)
-            summaries_done += 1
-        except Exception as e:
-            summary = ""
-        entry = (date, title, url, "", country, topic, summary)
-        country_articles[country].append(entry)
+def stage_summarize(run_id, state):
+    dedup = state["dedup"]
+    stories, related = _as_entries(dedup["stories"]), _as_related(dedup["related"])
+
+    plans = [_as_plan(values) for values in state["trends"]["top_queries"]]
+    shard = state.get("shard")
+    budget_total = MAX_SUMMARIES_PER_RUN
+    if shard:
+        # The shard's share of the run's budget, in proportion to its countries
+        trends = state["trends"]
+        budget_total = max(1, round(MAX_SUMMARIES_PER_RUN * len(trends["countries"]) / max(trends["total_countries"], 1)))
+    try:
+        to_summarize = schedule_summaries(stories, state["trends"].get("scores", {}), plans, budget=budget_total,
+                                          local_domains=state["trends"].get("local_domains"))
+    except Exception as e:
+        print(f"[WARN] Summary scheduling failed, taking stories in fetch order: {e}")
+        to_summarize = stories[:budget_total]
+    scheduled = len(to_summarize)
+    budget = defaultdict(int)
+    for article in to_summarize:
+        budget[article[1]] += 1
+    print(f"[INFO] Summary budget: {', '.join(f'{country} {n}' for country, n in budget.items())}")
+
+    stop_at = time.monotonic() + SUMMARIZE_DEADLINE
+    try:
+        summaries, skipped = summarize_articles([article[4] for article in to_summarize], stop_at=stop_at)
+    except Exception as e:
+        print(f"[WARN] Summarization pool failed, summarizing one by one: {e}")
+        summaries, skipped = [], 0
+        for article in to_summarize:
+            now = time.monotonic()
+            if now >= stop_at:
+                metrics.incr("article.skipped_deadline")
+                skipped += 1
+                summaries.append(None)
+                continue
+            summaries.append(summarize_article(article[4], deadline_at=min(stop_at, now + ARTICLE_DEADLINE)))
+    summaries_done = len(summaries) - skipped
+
+    try:
+        to_summarize, summaries, related = merge_summary_duplicates(to_summarize, summaries, related, run_id=run_id)
+    except Exception as e:
+        print(f"[WARN] Summary near-duplicate check failed: {e}")
+    total_merged = len(dedup["filtered_articles"]) - len(to_summarize) - (len(stories) - scheduled)
+
+    return {"summarized": [list(article) + [summary] for article, summary in zip(to_summarize, summaries)],
+            "related": related, "summaries_done": summaries_done, "skipped_at_deadline": skipped,
+            "total_merged": total_merged}
 
-    # ✨ Step 4: Build summary with run metadata
-    filter_status = "✅ Success" if not filter_failed else "❌ Failed (using raw)"
+def render_digest(now, country_articles, metadata):
+    filter_status = "✅ Success" if not metadata["filter_failed"] else "❌ Failed (using raw)"
     news_summary = f"""
     <html>
       <body>
@@ -463,27 +2669,40 @@ def main():
         <p style="font-size: 14px; color: #555;">
           This automated mail is generated to inform the user regarding key market insights. _Nabil.Hasan<br><br>
           <strong>📊 Run Metadata:</strong><br>
-          • Top queries checked: {len(top_queries)}<br>
-          • Raw articles fetched: {total_raw}<br>
-          • Filtered articles used: {total_filtered}<br>
-          • Articles summarized: {summaries_done}<br>
+          • Top queries checked: {metadata["top_queries"]}<br>
+          • Raw articles fetched: {metadata["total_raw"]}<br>
+          • Filtered articles used: {metadata["total_filtered"]}<br>
+          • Near-duplicates merged: {metadata["total_merged"]}<br>
+          • Articles summarized: {metadata["summaries_done"]}<br>
           • Cache update status: {filter_status}<br>
-        </p>
     """
+    if metadata.get("shards"):
+        shards = metadata["shards"]
+        missing = f" (missing {', '.join(str(i) for i in shards['missing'])})" if shards.get("missing") else ""
+        news_summary += f"      • Shards merged: {len(shards['merged'])}/{shards['count']}{missing}<br>\n"
+    if metadata.get("skipped_at_deadline"):
+        news_summary += f"      • Left unsummarized at the deadline: {metadata['skipped_at_deadline']}<br>\n"
+    for name, stats in metadata.get("pacing", {}).items():
+        news_summary += f"      • Pacing — {format_pacing_stats(name, stats)}<br>\n"
+    news_summary += "    </p>\n"
+    if metadata.get("timings"):
+        news_summary += render_timing_table(metadata["timings"])
 
-    # Step 5: Append country-wise news
-    for country in countries:
+    # Append country-wise news
+    for country in runtime.countries:
         news_summary += f"""\n <h2>{country} </h2>\n"""
         entries = country_articles[country]
         if entries:
             for idx, entry in enumerate(entries, 1):
-                publishedAt, title, url, _, _, topic, summary = entry
+                publishedAt, title, url, also, _, topic, summary = entry
                 news_summary += f"""
                     <p>
                       <h3>{idx}. {title} </h3>
                       [{topic}] {publishedAt}<br>
                       🔗 <a href="{url}" style="font-size: 0.9em; color: #555;">Read full article</a><br>
                 """
+                if also:
+                    news_summary += f"      🔁 Also relevant to: {also}<br>"
                 if summary:
                     news_summary += f"      📝 {summary}<br>"
                 news_summary += "</p>"
@@ -492,10 +2711,322 @@ def main():
 
     # Close HTML
     news_summary += "</body></html>"
+    return news_summary
+
+def render_timing_table(timings, top_calls=6):
+    """Compact HTML table of stage wall times and the costliest kinds of external call (summed over workers)."""
+    cell = 'style="padding: 0 12px 0 0;"'
+    rows = [f"<tr><td {cell}>stage: {stage}</td><td {cell}></td><td align=\"right\">{seconds:.1f}s</td></tr>"
+            for stage, seconds in timings["stages"].items()]
+    calls = sorted(timings["spans"].items(), key=lambda item: -item[1]["seconds"])[:top_calls]
+    rows += [f"<tr><td {cell}>{name}</td><td {cell} align=\"right\">{span['count']}×</td>"
+             f"<td align=\"right\">{span['seconds']:.1f}s</td></tr>" for name, span in calls]
+    counters = timings["counters"]
+    notes = ", ".join(f"{name} {round(value, 1):g}" for name, value in sorted(counters.items()) if value)
+    return (f'<p style="font-size: 12px; color: #555;"><strong>⏱ Timings:</strong></p>'
+            f'<table style="font-size: 12px; color: #555;">{"".join(rows)}</table>'
+            + (f'<p style="font-size: 12px; color: #555;">{notes}</p>' if notes else ""))
+
+def stage_digest(run_id, state):
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    summarize = state["summarize"]
+    related = _as_related(summarize["related"])
+
+    country_articles = {country: [] for country in runtime.countries}
+    for row in summarize["summarized"]:
+        date, country, topic, title, url, summary = row
+        also = ", ".join(f"{c} [{t}]" for c, t in related.get(url, []))
+        entry = (date, title, url, also, country, topic, summary)
+        country_articles.setdefault(country, []).append(entry)
+
+    metadata = {
+        "top_queries": len(state["trends"]["top_queries"]),
+        "total_raw": len(state["fetch"]["raw_articles"]),
+        "total_filtered": len(state["dedup"]["filtered_articles"]),
+        "filter_failed": state["dedup"]["filter_failed"],
+        "total_merged": summarize["total_merged"],
+        "summaries_done": summarize["summaries_done"],
+        "skipped_at_deadline": summarize.get("skipped_at_deadline", 0),
+        "shards": state["trends"].get("shards"),
+        "pacing": {name: state[stage]["pacing"] for name, stage in (("Trends", "trends"), ("NewsAPI", "fetch"))
+                   if state[stage].get("pacing")},
+        "timings": load_run_metrics(run_id),
+    }
+    news_summary = render_digest(now, country_articles, metadata)
 
-    # Step 6: Send the email
     print(f"Sending email with news summary length: {len(news_summary)} characters")
-    send_email(news_summary)
+    if not send_email(news_summary):
+        # Leave the stage incomplete so --resume only retries the send
+        raise RuntimeError("Failed to send the digest email.")
+    try:
+        record_sent_stories([tuple(row[:5]) for row in summarize["summarized"]],
+                            _as_entries(state["dedup"]["filtered_articles"]), run_id=run_id,
+                            summaries=[row[5] for row in summarize["summarized"]])
+    except Exception as e:
+        print(f"[WARN] Could not record the sent stories' fingerprints: {e}")
+    return {"sent_at": datetime.now(timezone.utc).isoformat(timespec="seconds"), "length": len(news_summary)}
+
+STAGE_FUNCTIONS = {
+    "trends": stage_trends,
+    "fetch": stage_fetch,
+    "dedup": stage_dedup,
+    "summarize": stage_summarize,
+    "digest": stage_digest,
+}
+#---------------------------------------------------------------------------------------------------------------------------
+def run_pipeline(resume=False, from_stage=None, to_stage=None, run_id=None, shard=None):
+    """
+    Run the stages in order and checkpoint each one.
+
+    resume      continue the latest unfinished run (younger than RESUME_MAX_AGE_HOURS) at its first
+                incomplete stage; start a new run if there is none
+    from_stage  reuse the latest run's checkpoints for the stages before it and rerun it and everything after
+    to_stage    stop after this stage
+    shard       run only this Shard of `run_id` (with its own checkpoints), up to summarize at most
+    Returns the run id.
+    """
+    first = STAGES.index(from_stage) if from_stage else 0
+    last = STAGES.index(to_stage) if to_stage else len(STAGES) - 1
+
+    if run_id is None and (resume or from_stage):
+        runs = _run_ids()
+        latest = runs[-1] if runs else None
+        if latest and from_stage:
+            run_id = latest
+        elif latest and load_checkpoint(latest, STAGES[-1]) is None and _run_age_hours(latest) <= RESUME_MAX_AGE_HOURS:
+            run_id = latest
+        elif from_stage and first > 0:
+            raise RuntimeError(f"No previous run to start at stage '{from_stage}' from.")
+    if run_id is None:
+        run_id = datetime.now(timezone.utc).strftime(RUN_ID_FORMAT)
+        print(f"[INFO] Starting pipeline run {run_id}")
+    elif shard:
+        print(f"[INFO] Pipeline run {run_id}, shard {shard.index}/{shard.count}")
+    else:
+        print(f"[INFO] Continuing pipeline run {run_id}")
+
+    state = {"shard": shard} if shard else {}
+    reusing = True
+    for idx, stage in enumerate(STAGES[:last + 1]):
+        if reusing and (idx < first or (resume and not from_stage)):
+            data = load_checkpoint(run_id, stage, shard)
+            if data is not None:
+                print(f"[INFO] Stage '{stage}': reusing checkpoint")
+                state[stage] = data
+                continue
+            if idx < first:
+                raise RuntimeError(f"Run {run_id} has no '{stage}' checkpoint; cannot start at '{from_stage}'.")
+        # From the first stage we run, everything after it is recomputed as well
+        reusing = False
+        print(f"[INFO] Stage '{stage}': running")
+        metrics.reset()
+        started = time.perf_counter()
+        try:
+            state[stage] = STAGE_FUNCTIONS[stage](run_id, state)
+            with metrics.span("checkpoint.save"):
+                save_checkpoint(run_id, stage, state[stage], shard)
+        except BaseException:
+            write_stage_metrics(run_id, stage, time.perf_counter() - started, status="failed", shard=shard)
+            raise
+        elapsed = time.perf_counter() - started
+        write_stage_metrics(run_id, stage, elapsed, shard=shard)
+        print(f"[INFO] Stage '{stage}' finished in {elapsed:.1f}s")
+
+    if shard:
+        return run_id  # exported and pruned by the reduce step
+    try:
+        write_prometheus_textfile(run_id)
+    except OSError as e:
+        print(f"[WARN] Could not write the Prometheus textfile: {e}")
+    prune_checkpoints()
+    return run_id
+
+def _artifact_path(run_id, shard):
+    return os.path.join(SHARD_DIR, run_id, f"{shard_tag(shard)}.json")
+
+def run_shard(shard, run_id=None, resume=False, from_stage=None, to_stage=None):
+    """Run one shard up to summarize and write its artifact. Returns the artifact's path."""
+    run_id = run_id or default_shard_run_id()
+    last = STAGES.index("summarize")
+    if STAGES.index(to_stage or "summarize") > last or STAGES.index(from_stage or STAGES[0]) > last:
+        raise ValueError("shards stop after 'summarize'; the digest is sent by the reduce step")
+    run_pipeline(resume=resume, from_stage=from_stage, to_stage=to_stage or "summarize", run_id=run_id, shard=shard)
+    if (to_stage or "summarize") != "summarize":
+        return None
+
+    stages = {stage: load_checkpoint(run_id, stage, shard) for stage in STAGES[:last + 1]}
+    payload = {"version": SHARD_ARTIFACT_VERSION, "run_id": run_id, "shard": list(shard),
+               "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"), "stages": stages,
+               "metrics": read_metrics_records(run_id, shard)}
+    path = _artifact_path(run_id, shard)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    print(f"[INFO] Shard {shard.index}/{shard.count} of run {run_id} written to {path}")
+    return path
+
+def load_shard_artifacts(run_id):
+    """The readable artifacts of `run_id`, by shard index; unreadable or other-version files are skipped."""
+    artifacts = {}
+    for path in sorted(glob.glob(os.path.join(SHARD_DIR, run_id, "shard-*-of-*.json"))):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Ignoring shard artifact {path}: {e}")
+            continue
+        if payload.get("version") != SHARD_ARTIFACT_VERSION or payload.get("run_id") != run_id:
+            print(f"[WARN] Ignoring shard artifact {path}: version {payload.get('version')}, run {payload.get('run_id')}")
+            continue
+        artifacts[Shard(*payload["shard"])] = payload
+    return artifacts
+
+def _add_related(related, url, pairs):
+    for pair in pairs:
+        pair = tuple(pair)
+        if pair not in related.setdefault(url, []):
+            related[url].append(pair)
+
+def _merged_pacing(shards, stage):
+    stats = [data[stage]["pacing"] for data in shards if data[stage].get("pacing")]
+    return merge_pacing_stats(stats) if stats else None
+
+def merge_shards(run_id, artifacts):
+    """
+    Fold shard artifacts into the trends/fetch/dedup/summarize stage data of one run. The merged rows are
+    stored and deduplicated against the article store, and near-duplicates across shards are collapsed.
+    """
+    shards = [artifacts[shard]["stages"] for shard in sorted(artifacts)]
+    count = next(iter(artifacts)).count
+    trends = {"top_queries": [plan for data in shards for plan in data["trends"]["top_queries"]],
+              "scores": {query: score for data in shards for query, score in data["trends"].get("scores", {}).items()},
+              "local_domains": {geo: domains for data in shards
+                                for geo, domains in data["trends"].get("local_domains", {}).items()},
+              "pacing": _merged_pacing(shards, "trends"),
+              "shards": {"count": count, "merged": sorted(shard.index for shard in artifacts)}}
+    fetch = {"raw_articles": [row for data in shards for row in data["fetch"]["raw_articles"]],
+             "marks": {query: mark for data in shards for query, mark in (data["fetch"].get("marks") or {}).items()},
+             "pacing": _merged_pacing(shards, "fetch")}
+
+    # Global dedup: the shards only read the store, so this is where the run's rows are stored
+    candidates = [tuple(row) for data in shards for row in data["dedup"]["filtered_articles"]]
+    filter_failed = any(data["dedup"]["filter_failed"] for data in shards)
+    try:
+        filtered_articles = update_and_filter_news_cache(candidates, run_id=run_id, marks=fetch["marks"])
+    except Exception as e:
+        print(f"Failed to update and filter news cache: {e}")
+        filtered_articles, filter_failed = candidates, True
+    new_urls = {entry[4] for entry in filtered_articles}
+
+    summaries, related, summarized = {}, {}, []
+    for data in shards:
+        for row in data["summarize"]["summarized"]:
+            entry = tuple(row[:5])
+            if entry[4] in new_urls and entry[4] not in summaries:
+                summaries[entry[4]] = row[5]
+                summarized.append(entry)
+        for url, pairs in data["summarize"]["related"].items():
+            _add_related(related, url, pairs)
+
+    # Near-duplicates across shards (the same story under two countries). Summarized entries come first,
+    # so a cluster is represented by one that has a summary whenever it can be.
+    entries = summarized + [entry for entry in filtered_articles if entry[4] not in summaries]
+    try:
+        stories, cross = cluster_near_duplicates(entries, run_id=run_id)
+    except Exception as e:
+        print(f"[WARN] Near-duplicate detection failed: {e}")
+        stories, cross = entries, {}
+    for url, pairs in cross.items():
+        _add_related(related, url, pairs)
+
+    to_send = [entry for entry in stories if entry[4] in summaries]
+    scheduled = len(to_send)
+    kept_summaries = [summaries[entry[4]] for entry in to_send]
+    try:
+        to_send, kept_summaries, related = merge_summary_duplicates(to_send, kept_summaries, related, run_id=run_id)
+    except Exception as e:
+        print(f"[WARN] Summary near-duplicate check failed: {e}")
+
+    dedup = {"filtered_articles": filtered_articles, "filter_failed": filter_failed, "stories": stories,
+             "related": related}
+    summarize = {"summarized": [list(entry) + [summary] for entry, summary in zip(to_send, kept_summaries)],
+                 "related": related,
+                 "summaries_done": sum(data["summarize"]["summaries_done"] for data in shards),
+                 "skipped_at_deadline": sum(data["summarize"].get("skipped_at_deadline", 0) for data in shards),
+                 "total_merged": len(filtered_articles) - len(stories) + scheduled - len(to_send)}
+    return {"trends": trends, "fetch": fetch, "dedup": dedup, "summarize": summarize}
+
+def reduce_shards(run_id=None, partial=False):
+    """
+    Merge the shard artifacts of `run_id` (default: the latest run under SHARD_DIR) into the run's
+    checkpoints and send its digest. Missing shards are an error unless `partial`.
+    """
+    if run_id is None:
+        runs = sorted(os.listdir(SHARD_DIR)) if os.path.isdir(SHARD_DIR) else []
+        if not runs:
+            raise RuntimeError(f"No shard artifacts under {SHARD_DIR}.")
+        run_id = runs[-1]
+    artifacts = load_shard_artifacts(run_id)
+    counts = {shard.count for shard in artifacts}
+    if not artifacts or len(counts) > 1:
+        raise RuntimeError(f"Run {run_id} has no consistent set of shard artifacts (shard counts: {sorted(counts)}).")
+    count = counts.pop()
+    missing = sorted(set(range(1, count + 1)) - {shard.index for shard in artifacts})
+    if missing and not partial:
+        raise RuntimeError(f"Run {run_id} is missing shard(s) {', '.join(f'{i}/{count}' for i in missing)}; "
+                           f"rerun them, or reduce with --partial.")
+    if missing:
+        print(f"[WARN] Reducing run {run_id} without shard(s) {', '.join(f'{i}/{count}' for i in missing)}")
+
+    print(f"[INFO] Reducing {len(artifacts)}/{count} shards of run {run_id}")
+    metrics.reset()
+    started = time.perf_counter()
+    state = merge_shards(run_id, artifacts)
+    state["trends"]["shards"]["missing"] = missing
+    for stage, data in state.items():
+        save_checkpoint(run_id, stage, data)
+    # The shards' stage records join the run's metrics, so the digest's timing table covers them
+    append_metrics_records(run_id, [dict(record, stage=f"{record['stage']} {shard.index}/{shard.count}")
+                                    for shard in sorted(artifacts) for record in artifacts[shard]["metrics"]])
+    write_stage_metrics(run_id, "reduce", time.perf_counter() - started)
+    return run_pipeline(run_id=run_id, from_stage="digest")
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Daily cement news digest.")
+    subparsers = parser.add_subparsers(dest="command")
+    run_parser = subparsers.add_parser("run", help="run the pipeline (default)")
+    run_parser.add_argument("--resume", action="store_true",
+                            help="continue the latest unfinished run at its first incomplete stage")
+    run_parser.add_argument("--from-stage", choices=STAGES, help="rerun from this stage using earlier checkpoints")
+    run_parser.add_argument("--to-stage", choices=STAGES, help="stop after this stage")
+    run_parser.add_argument("--only", choices=STAGES, help="run a single stage (same as --from-stage X --to-stage X)")
+    run_parser.add_argument("--shard", type=parse_shard, metavar="I/N",
+                            help="run shard I of N (countries split deterministically) up to summarize and "
+                                 "write its results for the reduce step")
+    run_parser.add_argument("--run-id", type=parse_run_id, metavar="YYYYMMDDTHHMMSSZ",
+                            help="run id shared by a run's shards (default: today, YYYYMMDDT000000Z)")
+    reduce_parser = subparsers.add_parser("reduce", help="merge a sharded run, dedup it globally and send the digest")
+    reduce_parser.add_argument("--run-id", type=parse_run_id, metavar="YYYYMMDDTHHMMSSZ",
+                               help="run to reduce (default: the latest one with shard artifacts)")
+    reduce_parser.add_argument("--partial", action="store_true", help="send the digest even if shards are missing")
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        return run_pipeline()
+    if args.command == "reduce":
+        return reduce_shards(run_id=args.run_id, partial=args.partial)
+    from_stage, to_stage = args.from_stage, args.to_stage
+    if args.only:
+        from_stage = to_stage = args.only
+    if args.shard:
+        if STAGES.index("digest") in (STAGES.index(from_stage or STAGES[0]), STAGES.index(to_stage or STAGES[0])):
+            parser.error("shards stop after 'summarize'; send the digest with `reduce`")
+        return run_shard(args.shard, run_id=args.run_id, resume=args.resume, from_stage=from_stage, to_stage=to_stage)
+    return run_pipeline(resume=args.resume, from_stage=from_stage, to_stage=to_stage, run_id=args.run_id)
 
 if __name__ == "__main__":
     try:
@@ -506,6 +3037,7 @@ if __name__ == "__main__":
           <body>
             <h2>🚨 Script Failure</h2>
             <p><strong>Error:</strong> {str(e)}</p>
+            <p>Finished stages are checkpointed; rerun with <code>python news_scraper.py run --resume</code> to continue.</p>
             <p>Please check logs or code for debugging.</p>
           </body>
         </html>
@@ -0,0 +1,150 @@
+"""
+Resumed and rerun pipeline runs must pick up where they stopped and see the same data they saw the first
+time: run_pipeline resumes at the first missing checkpoint, ArticleStore.add_new replays a run's own rows as
+new, fetch_marks reports the marks a run advanced at their previous value, and the legacy pickle caches
+are imported into articles.db exactly once. Everything runs in a temporary news_cache/.
+"""
+import os
+import pickle
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import news_scraper as ns
+
+RUN_A = "20261001T060000Z"
+RUN_B = "20261002T060000Z"
+ROWS = [("2026-09-30T08:00:00Z", "Pakistan", "cement price", "Cement prices rise in Karachi", "https://a.pk/1"),
+        ("2026-09-30T09:00:00Z", "Vietnam", "clinker export", "Clinker exports climb", "https://b.vn/2"),
+        ("2026-09-30T10:00:00Z", "Oman", "coal price change", "Coal costs squeeze producers", "https://c.om/3")]
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def stages(workdir, monkeypatch):
+    """Stub stages that log their calls and can be told to fail once."""
+    calls, failing = [], set()
+
+    def stub(name):
+        def stage(run_id, state):
+            calls.append(name)
+            if name in failing:
+                failing.discard(name)
+                raise RuntimeError(f"{name} failed")
+            # Each stage sees the checkpoints of the stages before it
+            return {"run_id": run_id, "seen": sorted(state)}
+        return stage
+
+    monkeypatch.setattr(ns, "STAGE_FUNCTIONS", {name: stub(name) for name in ns.STAGES})
+    return calls, failing
+
+def test_resume_starts_at_first_missing_checkpoint(stages):
+    calls, failing = stages
+    failing.add("dedup")
+    with pytest.raises(RuntimeError):
+        ns.run_pipeline()
+    assert calls == ["trends", "fetch", "dedup"]
+    run_id = ns._run_ids()[-1]
+    assert ns.load_checkpoint(run_id, "fetch") is not None
+    assert ns.load_checkpoint(run_id, "dedup") is None
+
+    calls.clear()
+    assert ns.run_pipeline(resume=True) == run_id
+    assert calls == ["dedup", "summarize", "digest"]
+    assert ns.load_checkpoint(run_id, "dedup")["seen"] == ["fetch", "trends"]
+    assert os.path.exists(os.path.join(ns.METRICS_DIR, f"{run_id}.jsonl"))
+
+def test_resume_of_a_stale_run_starts_a_new_run(stages):
+    calls, failing = stages
+    # RUN_A is older than RESUME_MAX_AGE_HOURS
+    failing.add("summarize")
+    with pytest.raises(RuntimeError):
+        ns.run_pipeline(run_id=RUN_A)
+    calls.clear()
+    assert ns.run_pipeline(resume=True) != RUN_A
+    assert calls == ns.STAGES
+
+def test_resume_after_a_finished_run_starts_a_new_run(stages):
+    calls, _ = stages
+    recent = (ns.datetime.now(ns.timezone.utc) - ns.timedelta(hours=1)).strftime(ns.RUN_ID_FORMAT)
+    ns.run_pipeline(run_id=recent)
+    calls.clear()
+    assert ns.run_pipeline(resume=True) != recent
+    assert calls == ns.STAGES
+
+def test_from_stage_reuses_earlier_checkpoints(stages):
+    calls, _ = stages
+    run_id = ns.run_pipeline(to_stage="dedup")
+    assert ns.load_checkpoint(run_id, "summarize") is None
+
+    calls.clear()
+    assert ns.run_pipeline(from_stage="fetch") == run_id
+    assert calls == ["fetch", "dedup", "summarize", "digest"]
+
+def test_from_stage_without_a_checkpoint_fails(stages):
+    calls, _ = stages
+    ns.run_pipeline(to_stage="trends")
+    with pytest.raises(RuntimeError, match="no 'fetch' checkpoint"):
+        ns.run_pipeline(from_stage="dedup")
+
+def test_add_new_replays_the_same_run(workdir):
+    with ns.ArticleStore() as store:
+        assert store.add_new(ROWS[:2], run_id=RUN_A) == ROWS[:2]
+        # A rerun of the same stage gets the same answer; its one new row is added
+        assert store.add_new(ROWS, run_id=RUN_A) == ROWS
+        # Another run sees none of them as new
+        assert store.add_new(ROWS, run_id=RUN_B) == []
+        assert store.unseen(ROWS + [ROWS[0][:4] + ("https://d.pk/4",)]) == [ROWS[0][:4] + ("https://d.pk/4",)]
+
+def test_rerun_fetches_the_same_window(workdir):
+    with ns.ArticleStore() as store:
+        store.advance_marks({"Pakistan cement price": "2026-09-29T00:00:00Z"}, run_id=RUN_A)
+        store.advance_marks({"Pakistan cement price": "2026-09-30T08:00:00Z",
+                             "Vietnam clinker export": "2026-09-30T09:00:00Z"}, run_id=RUN_B)
+
+        # RUN_B's rerun starts from the marks RUN_B started from
+        assert store.fetch_marks(RUN_B) == {"Pakistan cement price": "2026-09-29T00:00:00Z"}
+        # Advancing again within RUN_B keeps that previous value
+        store.advance_marks({"Pakistan cement price": "2026-09-30T12:00:00Z"}, run_id=RUN_B)
+        assert store.fetch_marks(RUN_B) == {"Pakistan cement price": "2026-09-29T00:00:00Z"}
+        # Later runs continue from where RUN_B got to, and marks never move back
+        store.advance_marks({"Pakistan cement price": "2026-09-01T00:00:00Z"}, run_id="20261003T060000Z")
+        assert store.fetch_marks() == {"Pakistan cement price": "2026-09-30T12:00:00Z",
+                                       "Vietnam clinker export": "2026-09-30T09:00:00Z"}
+
+def test_rerun_of_dedup_returns_the_same_new_rows(workdir):
+    marks = {"Pakistan cement price": "2026-09-30T08:00:00Z"}
+    first = ns.update_and_filter_news_cache(ROWS, run_id=RUN_A, marks=marks)
+    again = ns.update_and_filter_news_cache(ROWS, run_id=RUN_A, marks=marks)
+    assert first == again == ROWS
+    assert ns.load_fetch_marks(RUN_A) == {}
+    assert ns.load_fetch_marks(RUN_B) == marks
+
+def test_legacy_pickles_are_migrated_once(workdir):
+    os.makedirs(ns.CACHE_DIR)
+    _dump(ns.CACHE_FILENAME, [list(ROWS[2]), ("too", "short")])
+    _dump("Q3-2026.pkl", ROWS[:2] + [ROWS[2]])
+
+    with ns.ArticleStore() as store:
+        store.migrate_legacy_pickles()
+        assert store.unseen(ROWS) == []
+        migrated = dict(store.conn.execute("SELECT source, rows FROM migrations"))
+    # The archive is read first, so the row both files hold counts for the archive
+    assert migrated == {"Q3-2026.pkl": 3, ns.CACHE_FILENAME: 0}
+
+    # A later change to a migrated file is not imported again
+    extra = ROWS[0][:4] + ("https://d.pk/4",)
+    _dump(ns.CACHE_FILENAME, [extra])
+    with ns.ArticleStore() as store:
+        store.migrate_legacy_pickles()
+        assert store.unseen([extra]) == [extra]
+
+def _dump(name, entries):
+    with open(os.path.join(ns.CACHE_DIR, name), "wb") as f:
+        pickle.dump(entries, f)
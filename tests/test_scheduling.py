@@ -0,0 +1,72 @@
+"""
+The summary budget is dealt out fairly across countries (schedule_summaries), and the country → shard split
+(assign_shards / shard_plans) is deterministic, balanced and covers every plan exactly once.
+"""
+import os
+import sys
+from datetime import date
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import news_scraper as ns
+
+TODAY = date(2026, 10, 1)
+COUNTRIES = {"Pakistan": "PK", "Vietnam": "VN", "Oman": "OM", "Egypt": "EG", "Kenya": "KE"}
+PHRASES = ["cement price", "clinker export", "coal price change", "limestone shortage", "sea port congestion"]
+
+def _plans(countries=COUNTRIES, phrases=PHRASES):
+    return [ns.QueryPlan(f"{country} {phrase}", country, geo, phrase, ())
+            for country, geo in countries.items() for phrase in phrases]
+
+def _entries(country, count, day="2026-09-30"):
+    return [(f"{day}T{i:02d}:00:00Z", country, "cement price", f"{country} story {i}",
+             f"https://{country.lower()}.example/{i}") for i in range(count)]
+
+def test_budget_is_shared_round_robin_across_countries():
+    plans = _plans()
+    # Pakistan's query trends far above the others, and it has the most stories
+    scores = {plan.query: 100.0 if plan.country == "Pakistan" else 1.0 for plan in plans}
+    entries = _entries("Pakistan", 10) + _entries("Vietnam", 3) + _entries("Oman", 1)
+    chosen = ns.schedule_summaries(entries, scores, plans, budget=6, today=TODAY)
+    countries = [entry[1] for entry in chosen]
+    # Every country's best story first (best first), then the second round; Oman's spare turn goes to the others
+    assert countries[:3] == ["Pakistan", "Vietnam", "Oman"]
+    assert sorted(countries[3:]) == ["Pakistan", "Pakistan", "Vietnam"]
+    assert len(set(chosen)) == len(chosen) == 6
+
+def test_budget_prefers_recent_stories_within_a_country():
+    plans = _plans()
+    entries = _entries("Vietnam", 2, day="2026-09-20") + _entries("Vietnam", 2, day="2026-09-30")
+    chosen = ns.schedule_summaries(entries, {}, plans, budget=2, today=TODAY)
+    assert [entry[0][:10] for entry in chosen] == ["2026-09-30", "2026-09-30"]
+
+def test_schedule_handles_empty_input_and_budget():
+    assert ns.schedule_summaries([], {}, _plans(), budget=5) == []
+    assert ns.schedule_summaries(_entries("Oman", 3), {}, _plans(), budget=0) == []
+
+def test_assign_shards_is_deterministic_and_balanced():
+    plans = _plans()
+    assignment = ns.assign_shards(plans, 2)
+    assert assignment == ns.assign_shards(list(reversed(plans)), 2)
+    assert set(assignment) == set(COUNTRIES) and set(assignment.values()) == {1, 2}
+    loads = [sum(1 for plan in plans if assignment[plan.country] == index) for index in (1, 2)]
+    assert abs(loads[0] - loads[1]) <= len(PHRASES)
+
+def test_shard_plans_cover_every_plan_once():
+    plans = _plans()
+    for count in (1, 2, 3, 7):
+        seen = []
+        for index in range(1, count + 1):
+            shard_plans, countries = ns.shard_plans(plans, ns.Shard(index, count))
+            assert sorted({plan.country for plan in shard_plans}) == countries
+            seen.extend(shard_plans)
+        assert sorted(seen) == sorted(plans)
+
+def test_parse_shard():
+    assert ns.parse_shard("2/3") == ns.Shard(2, 3)
+    for value in ("0/3", "4/3", "x/3"):
+        with pytest.raises(ValueError):
+            ns.parse_shard(value)